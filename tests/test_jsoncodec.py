@@ -0,0 +1,65 @@
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'udplogserver'))
+
+from ms71lib import _jsoncodec, client
+
+
+class JsonCodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        obj = {'a': [1, 2.5, 'x', None, True], 'b': {'c': 'юникод'}, 'd': -7}
+        data = _jsoncodec.dumps(obj)
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(_jsoncodec.loads(data), obj)
+        self.assertEqual(_jsoncodec.loads(data.decode('utf-8')), obj)
+        self.assertEqual(_jsoncodec.loads(bytearray(data)), obj)
+
+    def test_default(self):
+        class Point:
+            pass
+        data = _jsoncodec.dumps([Point()], default=lambda o: 'point')
+        self.assertEqual(_jsoncodec.loads(data), ['point'])
+
+    def test_nan(self):
+        self.assertEqual(_jsoncodec.dumps(float('nan')), b'null')
+        data = _jsoncodec.dumps([float('nan'), float('inf')], allow_nan=True)
+        self.assertEqual(data, b'[NaN, Infinity]')
+        r = _jsoncodec.loads(data)
+        self.assertTrue(math.isnan(r[0]))
+        self.assertEqual(r[1], float('inf'))
+
+    def test_wide_ints(self):
+        n = 123456789012345678901234
+        data = _jsoncodec.dumps([n, -n])
+        self.assertEqual(_jsoncodec.loads(data, exact_ints=True), [n, -n])
+        self.assertEqual(_jsoncodec.loads(data), [float(n), float(-n)])
+
+    def test_object_hook(self):
+        hook = lambda d: ('hooked', d['$x']) if '$x' in d else d
+        data = _jsoncodec.dumps({'v': {'$x': 1}, 'w': {'y': 2}})
+        self.assertEqual(_jsoncodec.loads(data, object_hook=hook, marker='$x'),
+                         {'v': ('hooked', 1), 'w': {'y': 2}})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            _jsoncodec.loads(b'{"a": ')
+
+
+class RequestCodecTest(unittest.TestCase):
+
+    def test_request_round_trip(self):
+        data = client.dumps((1, 'two', [3]), {'k': None}, 'some.method')
+        self.assertEqual(client.loads(data), ([1, 'two', [3]], {'k': None}, 'some.method'))
+
+    def test_request_wide_ints(self):
+        n = 2 ** 70
+        data = client.dumps((n,), {}, 'm')
+        self.assertEqual(client.loads(data, exact_ints=True)[0], [n])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'udplogserver'))
+
+from ms71lib import client, server
+
+
+class CountingServer(server.ThreadingSimpleJSONRPCServer):
+    # counts accepted connections, to check keep-alive reuse
+
+    def __init__(self, *args, **kwargs):
+        self.connections = 0
+        self._count_lock = threading.Lock()
+        server.ThreadingSimpleJSONRPCServer.__init__(self, *args, **kwargs)
+
+    def process_request(self, request, client_address):
+        with self._count_lock:
+            self.connections += 1
+        server.ThreadingSimpleJSONRPCServer.process_request(self, request, client_address)
+
+
+class Api:
+
+    def add(self, a, b):
+        return a + b
+
+    def echo(self, *args, **kwargs):
+        return [args, kwargs]
+
+    def fail(self):
+        raise ValueError('boom')
+
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = CountingServer(('127.0.0.1', 0), logRequests=False)
+        self.server.register_instance(Api())
+        self.server.register_introspection_functions()
+        self.server.register_multicall_functions()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/RPC2' % self.server.server_address[1]
+        self.transport = client.Transport()
+        self.proxy = client.ServerProxy(self.url, transport=self.transport)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_calls(self):
+        self.assertEqual(self.proxy.add(2, 3), 5)
+        self.assertEqual(self.proxy.echo(1, 'x', k=[None, 1.5]), [[1, 'x'], {'k': [None, 1.5]}])
+        self.assertIn('add', self.proxy.system.listMethods())
+
+    def test_fault(self):
+        with self.assertRaises(client.Fault):
+            self.proxy.fail()
+        with self.assertRaises(client.Fault):
+            self.proxy.missing()
+        self.assertEqual(self.proxy.add(1, 1), 2)
+
+    def test_multicall(self):
+        m = client.MultiCall(self.proxy)
+        m.add(1, 2)
+        m.echo('a')
+        self.assertEqual(list(m()), [3, [['a'], {}]])
+
+    def test_gzip(self):
+        big = 'y' * 100000
+        self.assertEqual(self.proxy.echo(big), [[big], {}])
+
+    def test_keepalive(self):
+        for i in range(20):
+            self.assertEqual(self.proxy.add(i, 1), i + 1)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_threads(self):
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(10):
+                    if self.proxy.add(n, i) != n + i:
+                        errors.append((n, i))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(self.server.connections, 4)
+
+    def test_get(self):
+        url = self.url + '/echo?a&b=c%20d'
+        with urllib.request.urlopen(url) as f:
+            self.assertEqual(client.loads(f.read())[0], [[['a'], {'b': 'c d'}]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import datetime
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'udplogserver'))
+
+from ms71lib.objectid import ObjectId, InvalidId, FixedOffset, utc
+
+
+class ObjectIdTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        oid = ObjectId()
+        self.assertEqual(ObjectId(str(oid)), oid)
+        self.assertEqual(ObjectId(oid.hex), oid)
+        self.assertEqual(ObjectId(oid.binary), oid)
+        self.assertTrue(ObjectId.is_valid(oid.hex))
+
+    def test_from_datetime(self):
+        for dt in (datetime.datetime(2010, 1, 1),
+                   datetime.datetime(2030, 6, 15, 12, 30, 5),
+                   datetime.datetime(1960, 3, 1, 8),
+                   datetime.datetime(1901, 12, 14, 21, 0)):
+            oid = ObjectId.from_datetime(dt)
+            self.assertEqual(oid.generation_time, dt.replace(tzinfo=utc))
+
+    def test_from_datetime_aware(self):
+        dt = datetime.datetime(2020, 5, 1, 15, tzinfo=FixedOffset(180, 'MSK'))
+        oid = ObjectId.from_datetime(dt)
+        self.assertEqual(oid.generation_time, datetime.datetime(2020, 5, 1, 12, tzinfo=utc))
+
+    def test_from_datetime_out_of_range(self):
+        with self.assertRaises(struct.error):
+            ObjectId.from_datetime(datetime.datetime(2050, 1, 1))
+        with self.assertRaises(struct.error):
+            ObjectId.from_datetime(datetime.datetime(1800, 1, 1))
+
+    def test_generation_order(self):
+        a = ObjectId.from_datetime(datetime.datetime(1969, 12, 31))
+        b = ObjectId.from_datetime(datetime.datetime(2000, 1, 1))
+        self.assertLess(a.generation_time, b.generation_time)
+
+    def test_is_valid(self):
+        self.assertFalse(ObjectId.is_valid('x' * 24))
+        self.assertFalse(ObjectId.is_valid('0' * 1000000))
+        self.assertFalse(ObjectId.is_valid(None))
+        with self.assertRaises(InvalidId):
+            ObjectId('0' * 25)
+
+
+if __name__ == '__main__':
+    unittest.main()
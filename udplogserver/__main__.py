@@ -3,10 +3,18 @@
 __appname__ = 'udplogserver'
 __version__ = '2018.271.1350' #start the project
 
+import os
 import sys
 import time
 import queue
+import atexit
+import logging
+import logging.handlers
 import threading
+#libs и ms71lib лежат рядом с этим файлом, запуск как "python udplogserver" и как "python -m udplogserver" находит одни и те же модули
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
 import libs.utils as libs
 
 
@@ -26,15 +34,30 @@ def main():
         "kwargs": {},
         "addr": ("127.0.0.1", 0),
         }
-    sys.APPCONF["queue"] = queue.Queue()
+    sys.APPCONF["queue"] = libs.LogQueue()
     sys.APPCONF["params"], sys.APPCONF["kwargs"] = libs.handle_commandline()
     sys.APPCONF["addr"] = sys.APPCONF["kwargs"].pop("addr", sys.APPCONF["addr"])
+    setup_logging()
     rc = None
     try:
         prepare_server()
-        udpserver = libs.UDPServer(("127.0.0.1", 4122), libs.UDPHandler, log=print)
-        print(f'UDP server started at port {udpserver.addr[1]}', flush=True)
-        udpserver.serve_forever()
+        if "asyncio" == sys.APPCONF["kwargs"].get("loop"):
+            #loop=asyncio: прием пакетов через asyncio/uvloop вместо UDPServer
+            libs.serve_asyncio(("127.0.0.1", 4122), log=logging.getLogger(__appname__).info,
+                               rcvbuf=sys.APPCONF["kwargs"].get("rcvbuf"))
+        else:
+            #workers=N: N сокетов на одном порту (SO_REUSEPORT), каждый в своем потоке, очередь общая
+            workers = sys.APPCONF["kwargs"].get("workers", 1)
+            if not isinstance(workers, int) or workers < 1:
+                raise ValueError(f"workers must be a positive integer, got {workers!r}")
+            udpservers = [libs.UDPServer(("127.0.0.1", 4122), libs.UDPHandler, log=logging.getLogger(__appname__).info,
+                                         rcvbuf=sys.APPCONF["kwargs"].get("rcvbuf"), reuse_port=workers > 1)
+                          for i in range(workers)]
+            for udpserver in udpservers[1:]:
+                threading.Thread(target=udpserver.serve_forever, daemon=True).start()
+            udpserver = udpservers[0]
+            print(f'UDP server started at port {udpserver.addr[1]}', flush=True)
+            udpserver.serve_forever()
     except KeyboardInterrupt:
         rc = 0
     except Exception as e:
@@ -43,11 +66,24 @@ def main():
         libs.shutdown()
     return str(rc)
 
+def setup_logging():
+    """
+    записи лога пишет в stdout отдельный поток, рабочие потоки только кладут их в очередь
+    """
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    logging.basicConfig(level=logging.INFO, format='%(message)s', handlers=[logging.handlers.QueueHandler(log_queue)])
+    listener.start()
+    #останавливаем последним, чтобы успели записаться сообщения из других atexit-функций
+    atexit.register(listener.stop)
+
 def prepare_server():
     threads = []
     processes = []
     print(f'{__appname__} started at {time.strftime("%Y-%m-%d %H:%M:%S")}', flush=True)
-    threads.append(threading.Thread(target=libs.qRead, kwargs={'interval':10, 'size':10000}, daemon=True))
+    threads.append(threading.Thread(target=libs.qRead, kwargs={'interval':10, 'size':10000,
+                      'max_bytes':sys.APPCONF["kwargs"].get("max_bytes", 8*1024*1024),
+                      'data_format':sys.APPCONF["kwargs"].get("format", "json")}, daemon=True))
     for th in threads:
         th.start()
     for pr in processes:
@@ -3,38 +3,167 @@
 import os
 import sys
 import json
+import atexit
+import asyncio
 import time
+import logging
+import errno
+import ctypes
 import socket
+import struct
 import threading
+import selectors
 import traceback
 import socketserver
 import configparser
+import concurrent.futures
 from urllib.parse import unquote
+import orjson
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 import ms71lib.client as ms71_cli
 
-class UDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc_recvmmsg = _libc.recvmmsg
+except Exception:
+    #not Linux, receive one datagram per syscall
+    _libc_recvmmsg = None
+
+log = logging.getLogger(__name__)
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+class _RecvMMsg:
     """
-    Threading UDP server class
+    recvmmsg(2) wrapper, receives up to vlen datagrams per syscall into buffers allocated once
+    """
+
+    def __init__(self, sock, vlen, size):
+        self.fd = sock.fileno()
+        self.vlen = vlen
+        self.size = size
+        self.buf = ctypes.create_string_buffer(vlen * size)
+        self.base = ctypes.addressof(self.buf)
+        self.iov = (_iovec * vlen)()
+        self.msgs = (_mmsghdr * vlen)()
+        for i in range(vlen):
+            self.iov[i].iov_base = self.base + i * size
+            self.iov[i].iov_len = size
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iov[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def __call__(self):
+        n = _libc_recvmmsg(self.fd, self.msgs, self.vlen, socket.MSG_DONTWAIT, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, os.strerror(err))
+        base, size, msgs = self.base, self.size, self.msgs
+        return [ctypes.string_at(base + i * size, msgs[i].msg_len) for i in range(n)]
+
+
+class UDPServer(socketserver.UDPServer):
+    """
+    UDP server class, datagrams are received and queued in the serving thread
     """
 
-    daemon_threads = True
     allow_reuse_address = True
     socket_type = socket.SOCK_DGRAM
     #max_packet_size = 8192
     max_packet_size = 65536
 
-    def __init__(self, server_address, RequestHandlerClass, log):
+    #kernel receive buffer, net.core.rmem_max must be at least this big
+    rcvbuf_size = 12 * 1024 * 1024
+    #datagrams per recvmmsg call
+    recvmmsg_vlen = 64
+
+    def __init__(self, server_address, RequestHandlerClass, log, rcvbuf=None, reuse_port=False):
+        #несколько серверов на одном порту, ядро раскидывает пакеты между их сокетами
+        #(SO_REUSEPORT ставит server_bind из socketserver)
+        self.allow_reuse_port = reuse_port
         super(UDPServer, self).__init__(server_address, RequestHandlerClass)
         self.log = log
         self.addr = server_address
+        if rcvbuf:
+            self.rcvbuf_size = rcvbuf
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf_size)
+        self.log(f'UDP receive buffer is {self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes')
+        self._serving = False
+        self._recvmmsg = None
+        self._view = None
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        wait for the socket to become readable, then drain everything the kernel has queued,
+        no thread and no handler object per datagram
+        """
+        self._serving = True
+        self.socket.setblocking(False)
+        if _libc_recvmmsg:
+            self._recvmmsg = _RecvMMsg(self.socket, self.recvmmsg_vlen, self.max_packet_size)
+        else:
+            self._view = memoryview(bytearray(self.max_packet_size))
+        with selectors.DefaultSelector() as selector:
+            selector.register(self, selectors.EVENT_READ)
+            while self._serving:
+                if selector.select(poll_interval):
+                    try:
+                        self._drain()
+                    except OSError as e:
+                        #ENOBUFS, ECONNREFUSED from an ICMP error and the like: log it and keep serving
+                        self.log(f'UDP receive error: {e!r}')
+
+    def _drain(self):
+        q = sys.APPCONF["queue"]
+        if self._recvmmsg:
+            while True:
+                packets = self._recvmmsg()
+                if not packets:
+                    return
+                q.extend(packets)
+        #один буфер на все пакеты, в очередь уходит копия ровно полученных байт
+        view = self._view
+        recv_into = self.socket.recv_into
+        while True:
+            try:
+                n = recv_into(view)
+            except (BlockingIOError, InterruptedError):
+                return
+            q.put(bytes(view[:n]))
+
+    def shutdown(self):
+        self._serving = False
 
     def finish_request(self, request, client_address):
         self.RequestHandlerClass(request, client_address,  self)
 
     def handle_error(self, request, client_address):
         self.log('='*16)
-        self.log('Exception happened during processing of request from', client_address)
-        self.log(traceback.format_exc()) # XXX But this goes to stderr!
+        self.log(f'Exception happened during processing of request from {client_address}')
+        self.log(traceback.format_exc())
         self.log('='*16)
 
 class UDPHandler:
@@ -56,65 +185,187 @@ class UDPHandler:
         pass
 
     def handle(self):
-        data = self.request[0].strip().decode()
-        data = json.loads(data)
-        sock = self.request[1]
-        sys.APPCONF["queue"].put(data)
+        #разбор json делается в потоке записи, здесь только кладем пакет в очередь
+        sys.APPCONF["queue"].put(self.request[0])
 
     def finish(self):
         pass
 
+class UDPProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio variant of UDPServer, datagrams are queued straight from the event loop
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def datagram_received(self, data, addr):
+        self.queue.put(data)
+
+async def _serve_asyncio(server_address, log, rcvbuf):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: UDPProtocol(sys.APPCONF["queue"]), local_addr=server_address)
+    sock = transport.get_extra_info('socket')
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf or UDPServer.rcvbuf_size)
+    log(f'UDP receive buffer is {sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes')
+    log(f'UDP server started at port {sock.getsockname()[1]} ({"uvloop" if uvloop else "asyncio"})')
+    try:
+        await loop.create_future()
+    finally:
+        transport.close()
+
+def serve_asyncio(server_address, log, rcvbuf=None):
+    """
+    receive datagrams with an asyncio event loop (uvloop, if installed) instead of UDPServer
+    """
+    if uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(_serve_asyncio(server_address, log, rcvbuf))
+
+def _loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        #orjson is stricter than json (NaN, big ints), so give json a chance
+        return json.loads(data.decode(errors='replace'))
+
+_field_len = struct.Struct('<H')
 
-def qRead(interval=60, size=100000):
+def _unpack_binary(data):
+    """
+    пакет из полей utf-8, перед каждым полем его длина в 2 байта little-endian
     """
-    вычитываем длину очереди, и если там много элементов или подошло время, то даем задание на запись данных
+    unpack_from = _field_len.unpack_from
+    size = _field_len.size
+    fields = []
+    pos, end = 0, len(data)
+    while pos < end:
+        n, = unpack_from(data, pos)
+        pos += size
+        if pos + n > end:
+            raise ValueError("truncated field")
+        fields.append(data[pos:pos+n].decode())
+        pos += n
+    return fields
+
+def _unpack_msgpack(data):
+    return msgpack.unpackb(data, raw=False)
+
+#format=... в командной строке выбирает, как разбирать пакеты
+DATA_FORMATS = {
+    "json": _loads,
+    "msgpack": _unpack_msgpack,
+    "binary": _unpack_binary,
+}
+
+
+def qRead(interval=60, size=100000, max_bytes=8*1024*1024, data_format='json'):
     """
-    start_time = time.time()
+    ждем, пока в очереди не наберется size элементов или max_bytes байт или не пройдет interval,
+    и даем задание на запись данных
+    """
+    q = sys.APPCONF["queue"]
+    q.size = size
+    q.max_bytes = max_bytes
     key = ''
     with open('api.key', 'r') as f_obj:
         key = f_obj.read().strip()
     saveD = SaveData(base_type='text', 
     #saveD = SaveData(base_type='clickhouse', 
-                     connect_args={"uri":"https://online365.pro/ch/", "verbose":False, "api_key":key}
+                     connect_args={"uri":"https://online365.pro/ch/", "verbose":False, "api_key":key},
+                     data_format=data_format
                      )
     while True:
         try:
-            time_dif = time.time() - start_time
-            q_size = sys.APPCONF["queue"].qsize()
-            if time_dif >= interval or q_size >= size:
-                start_time = time.time()
-                #формируем данные и отдаем их на запись
-                full_data = []
-                for i in range(q_size):
-                    item = sys.APPCONF["queue"].get()
-                    full_data.append(item)
+            #формируем данные и отдаем их на запись
+            full_data = q.drain(interval)
+            if full_data:
                 saveD.pull(full_data)
-            time.sleep(1/100)
         except:
             traceback.print_exc()
 
 
+class LogQueue:
+    """
+    очередь пакетов: производители добавляют по одному или пачкой,
+    qRead забирает все накопленное за один захват блокировки,
+    как только набирается size пакетов или max_bytes байт
+    """
+
+    def __init__(self, size=100000, max_bytes=8*1024*1024):
+        self.size = size
+        self.max_bytes = max_bytes
+        self._items = []
+        self._count = 0
+        self._bytes = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def _full(self):
+        return self._count >= self.size or self._bytes >= self.max_bytes
+
+    def put(self, item):
+        with self._cond:
+            self._items.append(item)
+            self._count += 1
+            self._bytes += len(item)
+            if self._full():
+                self._cond.notify()
+
+    def extend(self, items):
+        with self._cond:
+            self._items.extend(items)
+            self._count += len(items)
+            self._bytes += sum(map(len, items))
+            if self._full():
+                self._cond.notify()
+
+    def qsize(self):
+        return self._count
+
+    def drain(self, timeout=None):
+        """
+        ждем заполнения не дольше timeout секунд и забираем все, что есть
+        """
+        with self._cond:
+            self._cond.wait_for(self._full, timeout)
+            items, self._items = self._items, []
+            self._count = 0
+            self._bytes = 0
+        return items
+
 
 class SaveData:
 
-    def __init__(self, base_type=None, connect_args=None):
+    def __init__(self, base_type=None, connect_args=None, data_format='json'):
         self.base_type = base_type
+        if data_format not in DATA_FORMATS:
+            raise ValueError(f"unknown data format {data_format!r}")
+        if data_format == 'msgpack' and not msgpack:
+            raise ValueError("msgpack format requires the msgpack package")
+        self._loads = DATA_FORMATS[data_format]
+        #не больше двух одновременных записей, остальные ждут в очереди пула
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='save')
+        #у каждого потока пула свое постоянное соединение с базой
+        self._local = threading.local()
+        self._servers = []
+        atexit.register(self.close)
         if self.base_type == 'clickhouse':
-            print("saving to clickhouse", flush=True)
+            log.info("saving to clickhouse")
             self._send = self._ch
             self._ch_args = connect_args
             self._create_ch_tables()
 
         elif self.base_type == 'postgres':
-            print("saving to postgres", flush=True)
+            log.info("saving to postgres")
             self._send = self._pg
             self._pg_args = connect_args
         elif self.base_type == 'firebird':
-            print("saving to firebird", flush=True)
+            log.info("saving to firebird")
             self._send = self._fb
             self._fb_args = connect_args
         else:
-            print("saving to stdout", flush=True)
+            log.info("saving to stdout")
             self._send = self._print
 
     def _create_ch_tables(self):
@@ -136,56 +387,77 @@ class SaveData:
         request = server("request")
         for i in sqls:
             r = request(i.encode())
-        server('close')
+        server('close')()
 
     def _make_connect(self):
         pass
 
+    def _ch_server(self):
+        server = getattr(self._local, 'server', None)
+        if server is None:
+            server = self._local.server = ms71_cli.ServerProxy(**self._ch_args)
+            self._servers.append(server)
+        return server
+
     def _ch(self, full_data):
-        server = ms71_cli.ServerProxy(**self._ch_args)  
-        request = server("request")
-        sql = "INSERT INTO udp_logs.logs FORMAT Values %s;"
-        s = []
-        #print("saving to clickhouse", flush=True)
+        #транспорт сам закрывает соединение при ошибке и переоткрывает при следующем запросе
+        request = self._ch_server()("request")
+        #строки пишем сразу в тело запроса, без списка и склейки в конце
+        body = bytearray(b"INSERT INTO udp_logs.logs FORMAT JSONEachRow\n")
+        header_len = len(body)
         for i in full_data:
             try:
-                s.append(f"""('{str(i[0])}', '{str(i[1])}', '{str(i[2])}', '{str(i[3]).replace("'", '"')}', '{str(i[4])}', '{str(i[4].split()[0])}') """)
-                #for i in item:
-                    
-                    #print(i, type(i), sep="\t\t")
-                #print(item, flush=True)
+                payload = i[3] if isinstance(i[3], str) else orjson.dumps(i[3]).decode()
+                row = orjson.dumps({"application": str(i[0]), "type": str(i[1]), "user": str(i[2]),
+                                    "payload": payload, "dt": str(i[4]), "date": i[4].split()[0]})
             except:
-                pass
-                print("-"*20, flush=True)
-                print(i, flush=True)
-                print("-"*20, flush=True)
-        if len(s) > 0:
-            sq = sql % ', '.join(s)
-            #sq = sq.replace("'", '"')
-            #print(sq)
-            request(sq.encode())
-        server("close")
-                
+                log.warning("%s\n%r\n%s", "-"*20, i, "-"*20)
+                continue
+            body += row
+            body += b"\n"
+        if len(body) > header_len:
+            request(body)
+
 
     def _pg(self, full_data):
-        #print("saving to postgres", flush=True)
+        #log.info("saving to postgres")
         for item in full_data:
-            print(item, flush=True)
+            log.info("%s", item)
 
     def _fb(self, full_data):
-        #print("saving to firebird", flush=True)
+        #log.info("saving to firebird")
         for item in full_data:
-            print(item, flush=True)
+            log.info("%s", item)
 
     def _print(self, full_data):
         """
         записываем данные куда-то
         """
         for item in full_data:
-            print(item, flush=True)
+            log.info("%s", item)
 
     def pull(self, full_data):
-        threading.Thread(target=self._send, args=(full_data,), daemon=True).start()
+        self._pool.submit(self._save, full_data).add_done_callback(self._done)
+
+    def _save(self, full_data):
+        rows = []
+        for data in full_data:
+            try:
+                rows.append(self._loads(data))
+            except Exception:
+                log.warning("%s\n%r\n%s", "-"*20, data, "-"*20)
+        if rows:
+            self._send(rows)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        while self._servers:
+            self._servers.pop()("close")()
+
+    def _done(self, future):
+        e = future.exception()
+        if e:
+            log.error("saving failed", exc_info=e)
 
 
 
@@ -223,11 +495,17 @@ def handle_commandline():
 
 
 def _int(x):
-    try:
-        fx = float(x)
-        ix = int(fx)
-        return ix if ix == fx else fx
-    except:
-        return x
+    #целые разбираем без исключений, float пробуем только для строк, похожих на число с точкой или экспонентой
+    s = x[1:] if x[:1] in ('-', '+') else x
+    if s.isdecimal():
+        return int(x)
+    if '.' in x or 'e' in x or 'E' in x:
+        try:
+            fx = float(x)
+            ix = int(fx)
+            return ix if ix == fx else fx
+        except (ValueError, OverflowError):
+            return x
+    return x
 
     
\ No newline at end of file
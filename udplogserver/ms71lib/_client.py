@@ -133,23 +133,39 @@ from datetime import datetime, date
 import http.client
 import urllib.request
 import urllib.parse
+import urllib.error
 import random
 import traceback
+import types
 try:
     import ssl
     ssl._create_default_https_context = ssl._create_unverified_context
 except:
     pass
-# JSON library importing
-try:
-    import cjson as json
-except ImportError:
-    import json
+
+# one SSL context for every HTTPS connection of the process, built on
+# first use: HTTPSConnection would otherwise create a new one (and load
+# the CA store) per socket; sharing it also lets OpenSSL resume sessions
+_DEFAULT_SSL_CTX = None
+
+def _ssl_context():
+    global _DEFAULT_SSL_CTX
+    if _DEFAULT_SSL_CTX is None:
+        _DEFAULT_SSL_CTX = ssl._create_default_https_context()
+    return _DEFAULT_SSL_CTX
+
+# JSON library importing: see _jsoncodec for the orjson/json selection
+from . import _jsoncodec
+import json
+import codecs
 import socket
+import select
 import errno
+import threading
 from io import BytesIO
 try:
     import gzip
+    import zlib
 except ImportError:
     gzip = None  # python can be built without zlib/gzip support
 
@@ -278,16 +294,47 @@ else:
 del _day0
 
 
+def _strftime_tuple(value):
+    return "%04d%02d%02dT%02d:%02d:%02d" % value[:6]
+
+def _strftime_int(value):
+    if value == 0:
+        value = time.time()
+    return "%04d%02d%02dT%02d:%02d:%02d" % time.localtime(value)[:6]
+
+# exact type -> formatter, subclasses go through the isinstance checks
+_STRFTIME = {
+    datetime: _iso8601_format,
+    tuple: _strftime_tuple,
+    time.struct_time: _strftime_tuple,
+    int: _strftime_int,
+    float: _strftime_int,
+}
+
 def _strftime(value):
+    f = _STRFTIME.get(type(value))
+    if f is not None:
+        return f(value)
+
     if isinstance(value, datetime):
         return _iso8601_format(value)
 
-    if not isinstance(value, (tuple, time.struct_time)):
-        if value == 0:
-            value = time.time()
-        value = time.localtime(value)
+    if isinstance(value, (tuple, time.struct_time)):
+        return _strftime_tuple(value)
 
-    return "%04d%02d%02dT%02d:%02d:%02d" % value[:6]
+    return _strftime_int(value)
+
+def _parse_iso8601(value):
+    # "YYYYMMDDTHH:MM:SS" -> struct_time, sliced by hand since the
+    # format is fixed; strptime only for anything unexpected
+    if len(value) == 17 and value[8] == 'T' and value[11] == value[14] == ':':
+        try:
+            return datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                            int(value[9:11]), int(value[12:14]),
+                            int(value[15:])).timetuple()
+        except ValueError:
+            pass
+    return time.strptime(value, "%Y%m%dT%H:%M:%S")
 
 class DateTime:
     """DateTime wrapper for an ISO 8601 string or time tuple or
@@ -342,8 +389,15 @@ class DateTime:
         s, o = self.make_comparable(other)
         return s == o
 
+    # (value, struct_time) of the last timetuple() call
+    _parsed = (None, None)
+
     def timetuple(self):
-        return time.strptime(self.value, "%Y%m%dT%H:%M:%S")
+        value, tt = self._parsed
+        if value is not self.value:
+            tt = _parse_iso8601(self.value)
+            self._parsed = self.value, tt
+        return tt
 
     ##
     # Get date/time value.
@@ -406,16 +460,17 @@ class Binary:
         return self.data == other
 
     def decode(self, data):
-        self.data = base64.decodebytes(data)
+        # b64decode skips the line breaks encodebytes used to insert
+        self.data = base64.b64decode(data)
 
     def encode(self, out):
-        encoded = base64.encodebytes(self.data)
-        out.write(encoded.decode('ascii'))
+        out.write(base64.b64encode(self.data).decode('ascii'))
 
 def _binary(data):
-    # decode json element contents into a Binary structure
-    value = Binary()
-    value.decode(data)
+    # decode json element contents into a Binary structure; the data
+    # comes from the decoder, so __init__'s type check is skipped
+    value = Binary.__new__(Binary)
+    value.data = base64.b64decode(data)
     return value
 
 WRAPPERS = (DateTime, Binary)
@@ -427,12 +482,16 @@ class _MultiCallMethod:
     # some lesser magic to store calls made to a MultiCall object
     # for batch execution
     def __init__(self, call_list, name):
+        # call_list is a (names, params, kwargs) triple of parallel lists
         self.__call_list = call_list
         self.__name = name
     def __getattr__(self, name):
         return _MultiCallMethod(self.__call_list, "%s.%s" % (self.__name, name))
     def __call__(self, *args, **kwargs):
-        self.__call_list.append((self.__name, args, kwargs))
+        names, params, kwargs_list = self.__call_list
+        names.append(self.__name)
+        params.append(args)
+        kwargs_list.append(kwargs)
 
 class MultiCallIterator:
     """Iterates over the results of a multicall. Exceptions are
@@ -443,9 +502,9 @@ class MultiCallIterator:
 
     def __getitem__(self, i):
         item = self.results[i]
-        if type(item) == type({}):
+        if isinstance(item, dict):
             raise Fault(item['faultCode'], item['faultString'])
-        elif type(item) == type([]):
+        elif isinstance(item, list):
             return item[0]
         else:
             raise ValueError("unexpected type in multicall result")
@@ -469,7 +528,7 @@ class MultiCall:
 
     def __init__(self, server):
         self.__server = server
-        self.__call_list = []
+        self.__call_list = ([], [], [])
 
     def __repr__(self):
         return "<%s at %#x>" % (self.__class__.__name__, id(self))
@@ -481,15 +540,16 @@ class MultiCall:
 
     def __call__(self):
         marshalled_list = []
-        #for name, params, kwargs in self.__call_list:
-        while self.__call_list:
-            name, params, kwargs = self.__call_list.pop(0)
+        for name, params, kwargs in zip(*self.__call_list):
             f = {"method": name}
             if params:
                 f["params"] = params
             if kwargs:
                 f["kwargs"] = kwargs
             marshalled_list.append(f)
+        # the calls are sent once, the same as when they were popped off
+        for l in self.__call_list:
+            l.clear()
         return MultiCallIterator(self.__server.system.multicall(marshalled_list))
 
 # --------------------------------------------------------------------
@@ -511,22 +571,33 @@ FastMarshaller = FastParser = FastUnmarshaller = None
 # @return A string containing marshalled data.
 
 import decimal
+def _ext_default(obj):
+    if isinstance(obj, Binary):
+        return {'__binary__': base64.b64encode(obj.data).decode('ascii')}
+    elif isinstance(obj, decimal.Decimal):
+        return float(obj)
+    elif isinstance(obj, datetime):
+        return str(obj)
+    elif isinstance(obj, date):
+        return str(obj)
+    elif isinstance(obj, set):
+        return list(obj)
+    raise TypeError("Object of type %s is not JSON serializable" %
+                    obj.__class__.__name__)
+
 class ExtJSONEncoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, Binary):
-            return {'__binary__': obj.encode()}
-        elif isinstance(obj, decimal.Decimal):
-            return float(obj)
-        elif isinstance(obj, datetime):
-            return str(obj)
-        elif isinstance(obj, date):
-            return str(obj)
-        elif isinstance(obj, set):
-            return list(obj)
-        return json.JSONEncoder.default(self, obj)
+        return _ext_default(obj)
+
+# JSONEncoder keeps no per-call state, one instance serves every thread
+_ENCODER = ExtJSONEncoder(ensure_ascii=False)
+
+def _dumps(obj, allow_nan=False):
+    # obj -> JSON text as UTF-8 bytes
+    return _jsoncodec.dumps(obj, _ext_default, _ENCODER, allow_nan)
 
 def dumps(params, kwargs=None, methodname=None, methodresponse=None, encoding=None,
-          allow_none=True):
+          allow_none=True, allow_nan=False):
     """data [,options] -> marshalled data
 
     Convert an argument tuple or a Fault instance to an JSON-RPC
@@ -543,6 +614,9 @@ def dumps(params, kwargs=None, methodname=None, methodresponse=None, encoding=No
 
         encoding: the packet encoding (default is UTF-8)
 
+        allow_nan: write NaN and Infinity as such, not as null (the
+        result is not strict JSON)
+
     All 8-bit strings in the data structure are assumed to use the
     packet encoding.  Unicode strings are automatically converted,
     where necessary.
@@ -556,26 +630,22 @@ def dumps(params, kwargs=None, methodname=None, methodresponse=None, encoding=No
         methodresponse = 1
         error = [params.faultCode, params.faultString]
 
-    kwdata = None
-    if error is None:
-        data = json.dumps(params, ensure_ascii=False, cls=ExtJSONEncoder)
-        if kwargs:
-            kwdata = json.dumps(kwargs, ensure_ascii=False, cls=ExtJSONEncoder)
-    else:
-        data = json.dumps(error, ensure_ascii=False, cls=ExtJSONEncoder)
-
-    # standard JSON-RPC wrappings
+    # standard JSON-RPC wrappings, serialized in one pass
     if methodname:
-        data = '{"method": %s%s%s}' % (
-            json.dumps(methodname, ensure_ascii=False, cls=ExtJSONEncoder),
-            ',\n "params": {0}'.format(data) if params else '',
-            ',\n "kwargs": {0}\n'.format(kwdata) if kwargs else ''
-        )
+        data = {"method": methodname}
+        if params:
+            data["params"] = params
+        if kwargs:
+            data["kwargs"] = kwargs
     elif methodresponse:
         # a method response, or a fault structure
-        data = "{%s: %s}" % ('"result"' if error is None else '"error"', data)
-    #print(type(data), data)
-    return data.encode(encoding)  # return as is
+        data = {"result": params} if error is None else {"error": error}
+    else:
+        data = params if error is None else error
+    data = _dumps(data, allow_nan)
+    if codecs.lookup(encoding).name != "utf-8":
+        data = data.decode("utf-8").encode(encoding)
+    return data
 
 ##
 # Convert an JSON-RPC packet to a Python object.  If the JSON-RPC packet
@@ -586,35 +656,47 @@ def dumps(params, kwargs=None, methodname=None, methodresponse=None, encoding=No
 #     (None if not present).
 # @see Fault
 
-def loads(data, use_datetime=False, use_builtin_types=None):
+def loads(data, use_datetime=False, use_builtin_types=None, exact_ints=False):
     """data -> unmarshalled data, method name
 
     Convert an JSON-RPC packet to unmarshalled data plus a method
-    name (None if not present).
+    name (None if not present). With exact_ints, integers wider than
+    64 bits aren't turned into floats.
 
     If the JSON-RPC packet represents a fault condition, this function
     raises a Fault exception.
     """
     if hasattr(data, 'read'):
         data = data.read()
-    if isinstance(data, bytes):
-        r = json.loads(data.decode('utf8'), object_hook=_object_hook)
-    else:
-        r = json.loads(data, object_hook=_object_hook)
-    if "method" in r:
-        params = r.pop("params") if "params" in r else []
-        kwargs = r.pop("kwargs") if "kwargs" in r else {}
-        return params, kwargs, r['method']
-    elif "result" in r:
-        return r.pop("result"), {}, None
-    else:
-        raise Fault(*r.pop("error"))
+    r = _loads(data, exact_ints)
+    method = r.get("method", _MISSING)
+    if method is not _MISSING:
+        # only unpacked into the call, the empty tuple can be shared
+        params = r.get("params", ())
+        kwargs = r.get("kwargs", _MISSING)
+        return params, {} if kwargs is _MISSING else kwargs, method
+    result = r.get("result", _MISSING)
+    if result is not _MISSING:
+        return result, {}, None
+    raise Fault(*r["error"])
+
+# "key not present" for dict.get(), where None is a legal value
+_MISSING = object()
 
 def _object_hook(obj):
-    if '__binary__' in obj:
-        return _binary(obj.pop('__binary__'))
-    else:
+    data = obj.get('__binary__', _MISSING)
+    if data is _MISSING:
         return obj
+    return _binary(data)
+
+def _loads(data, exact_ints=False):
+    # JSON text (bytes or str) -> Python objects with Binary values restored;
+    # the hook only runs when the marker occurs in the text at all
+    return _jsoncodec.loads(data, _object_hook, '"__binary__"', exact_ints)
+
+# gzip member header: magic, deflate method, no flags
+GZIP_MAGIC = b"\x1f\x8b\x08\x00"
+_ACCEPT_GZIP_HEADER = ("Accept-Encoding", "gzip")
 
 ##
 # Encode a string using the gzip content encoding such as specified by the
@@ -631,22 +713,20 @@ def gzip_encode(data):
     """
     if not gzip:
         raise NotImplementedError
-    f = BytesIO()
-    with gzip.GzipFile(mode="wb", fileobj=f, compresslevel=1) as gzf:
-        if data.__class__.__name__ in ("generator", "list", "tuple"):
-            for row in data:
-                gzf.write(row)
-        elif hasattr(data, "read"):
-            part = data.read(4096)
-            while part:
-                gzf.write(part)
-                part = data.read(4096)
-        else:
-            gzf.write(data)
-        #gzf.close()
-    encoded = f.getvalue()
-    f.close()
-    return encoded
+    # wbits=31: zlib writes the gzip header and trailer itself
+    co = zlib.compressobj(1, zlib.DEFLATED, 31)
+    if isinstance(data, (types.GeneratorType, list, tuple)):
+        chunks = [co.compress(row) for row in data]
+    elif hasattr(data, "read"):
+        chunks = []
+        part = data.read(65536)
+        while part:
+            chunks.append(co.compress(part))
+            part = data.read(65536)
+    else:
+        chunks = [co.compress(data)]
+    chunks.append(co.flush())
+    return b"".join(chunks)
 
 ##
 # Decode a string using the gzip content encoding such as specified by the
@@ -667,43 +747,21 @@ def gzip_decode(data, max_decode=-1):
     """
     if not gzip:
         raise NotImplementedError
+    if max_decode < 0: # no limit
+        # one shot through zlib, no GzipFile buffering
+        try:
+            return gzip.decompress(data)
+        except OSError:
+            raise ValueError("invalid data")
     with gzip.GzipFile(mode="rb", fileobj=BytesIO(data)) as gzf:
         try:
-            if max_decode < 0: # no limit
-                decoded = gzf.read()
-            else:
-                decoded = gzf.read(max_decode + 1)
+            decoded = gzf.read(max_decode + 1)
         except OSError:
             raise ValueError("invalid data")
     if max_decode >= 0 and len(decoded) > max_decode:
         raise ValueError("max gzipped payload length exceeded")
     return decoded
 
-##
-# Return a decoded file-like object for the gzip encoding
-# as described in RFC 1952.
-#
-# @param response A stream supporting a read() method
-# @return a file-like object that the decoded data can be read() from
-
-class GzipDecodedResponse(gzip.GzipFile if gzip else object):
-    """a file-like object to decode a response encoded with the gzip
-    method, as described in RFC 1952.
-    """
-    def __init__(self, response):
-        #response doesn't support tell() and read(), required by
-        #GzipFile
-        if not gzip:
-            raise NotImplementedError
-        self.io = BytesIO(response.read())
-        gzip.GzipFile.__init__(self, mode="rb", fileobj=self.io)
-
-    def close(self):
-        try:
-            gzip.GzipFile.close(self)
-        finally:
-            self.io.close()
-
 
 # --------------------------------------------------------------------
 # request dispatcher
@@ -725,7 +783,27 @@ class _Method:
 # You can create custom transports by subclassing this method, and
 # overriding selected methods.
 
-from collections import OrderedDict
+from collections import deque
+
+# select() can't take descriptors above FD_SETSIZE (1024)
+_poll = getattr(select, 'poll', None)
+
+def _is_alive(connection):
+    # an idle keep-alive socket that turned readable has been closed
+    # (or answered out of turn) by the server
+    sock = connection.sock
+    if sock is None:
+        return True  # not connected yet, or reconnects on use
+    try:
+        if _poll is not None:
+            p = _poll()
+            p.register(sock, select.POLLIN)
+            return not p.poll(0)
+        r, w, x = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not r
+
 class Transport:
     """Handles an HTTP transaction to an JSON-RPC server."""
 
@@ -740,10 +818,24 @@ class Transport:
     # that they can decode such a request
     encode_threshold = 1400  # None = don't encode
 
-    def __init__(self, use_datetime=False, use_builtin_types=False, api_key="", host_name=""):
+    # idle keep-alive connections kept per host; the connection in use
+    # is per thread, so threads sharing a transport (or its ServerProxy)
+    # each take one from the pool
+    pool_size = 8
+
+    # socket read/write size of new connections
+    blocksize = 65536
+
+    def __init__(self, use_datetime=False, use_builtin_types=False, api_key="", host_name="",
+                 max_keepalive=None):
+        if max_keepalive is not None:
+            self.pool_size = max_keepalive
         self._use_datetime = use_datetime
         self._use_builtin_types = use_builtin_types
-        self._connection = (None, None)
+        self._local = threading.local()
+        self._pool = {}
+        self._pool_lock = threading.Lock()
+        self._host_info = {}
         self._extra_headers = []
         self._api_key = api_key
         self._host_name = host_name
@@ -751,6 +843,19 @@ class Transport:
         self._http_method = 'POST'
         self._api_headers = None
         self._hosts301 = {}
+        self._locations = {}
+        self._headers_key = None
+        self._headers = ()
+        self._header_names = frozenset()
+
+    # (host, connection) of the request this thread has in flight
+    @property
+    def _connection(self):
+        return getattr(self._local, 'connection', (None, None))
+
+    @_connection.setter
+    def _connection(self, value):
+        self._local.connection = value
 
     ##
     # Send a complete request, and parse the response.
@@ -787,9 +892,15 @@ class Transport:
                 #print(333, location)
                 #localhost:4005 /db/query b'["select * from foo", "select * from foo1", "select 1, 2, 3 union all select \'\\u041f\\u0440\\u0438\\u0432\\u0435\\u0442\', \'\\u041c\\u0438\\u0440\', \'!\'"]' False
                 #print(333, host, handler, request_body, verbose)
-                _up = urllib.parse.urlparse(location)
-                host2 = _up.netloc
-                fg2 = 'https' == _up.scheme
+                try:
+                    host2, fg2 = self._locations[location]
+                except KeyError:
+                    if len(self._locations) >= 32:
+                        # a server sending unique Location urls would
+                        # grow it forever; the usual few come right back
+                        self._locations.clear()
+                    _up = urllib.parse.urlparse(location)
+                    host2, fg2 = self._locations[location] = _up.netloc, 'https' == _up.scheme
                 #print(333, host2, handler, request_body, verbose)
                 #sys.exit(0)
                 if host2:
@@ -799,9 +910,9 @@ class Transport:
                         if fg1:
                             self._connection = host2, http.client.HTTPConnection(chost, timeout=self._timeout)
                         else:
-                            kw = x509 or {}
+                            kw = dict(x509 or {})
                             kw['timeout'] = self._timeout
-                            self._connection = host2, http.client.HTTPSConnection(chost, None, context=None, **kw)
+                            self._connection = host2, http.client.HTTPSConnection(chost, None, context=_ssl_context(), **kw)
                     http_conn = self.send_request(host2, handler, request_body, verbose)
                     resp = http_conn.getresponse()
                     if host2 in self._hosts301:
@@ -809,41 +920,48 @@ class Transport:
                     self._hosts301[host] = host2
                 else:
                     resp.read()
+                    self._release(resp)
                     return (location,)
             if resp.status == 200:
                 self.verbose = verbose
-                return self.parse_response(resp)
+                r = self.parse_response(resp)
+                self._release(resp)
+                return r
         except Fault as e:
             print('err1', e)
             raise
-        except Exception as e:
+        except (http.client.HTTPException, OSError) as e:
             print('err2:', e)
             #All unexpected errors leave connection in
             # a strange state, so we clear it.
             self.close()
             raise
+        except Exception:
+            # not a transport failure, only the connection in use is
+            # suspect, the pooled ones are kept
+            self._discard()
+            raise
 
         #We got an error response.
         #Discard any response data and raise exception
         #if resp.getheader("content-length", ""):
         body = resp.read()
-        if body.startswith(b"\x1f\x8b\x08\x00"):
-            body = gzip_decode(body).decode()
-        else:
-            body = body.decode()
+        # the response is consumed, the connection is still good
+        self._release(resp)
+        if body[:4] == GZIP_MAGIC:
+            # only for the error message, don't inflate more than that
+            try:
+                body = gzip_decode(body, max_decode=65536)
+            except ValueError:
+                body = b""
+        body = body.decode(errors="replace")
         #print(type(body), body)
-        if body:
-            raise ProtocolError(
-                host + handler,
-                resp.status, resp.reason + '\n' + body,
-                dict(resp.getheaders())
-            )
-        else:
-            raise ProtocolError(
-                host + handler,
-                resp.status, resp.reason,
-                dict(resp.getheaders())
-            )
+        reason = resp.reason + '\n' + body if body else resp.reason
+        raise ProtocolError(
+            host + handler,
+            resp.status, reason,
+            dict(resp.getheaders())
+        )
 
     ##
     # Get authorization info from host parameter
@@ -860,19 +978,27 @@ class Transport:
         x509 = {}
         if isinstance(host, tuple):
             host, x509 = host
+        else:
+            # the result for a plain host string never changes
+            info = self._host_info.get(host)
+            if info is not None:
+                return info
+        key = host
 
-        auth, host = urllib.parse.splituser(host)
+        # what the deprecated urllib.parse.splituser did
+        auth, delim, host = host.rpartition('@')
 
         if auth:
             auth = urllib.parse.unquote_to_bytes(auth)
-            auth = base64.encodebytes(auth).decode("utf-8")
-            auth = "".join(auth.split()) # get rid of whitespace
+            auth = base64.b64encode(auth).decode("ascii")
             extra_headers = [
                 ("Authorization", "Basic " + auth)
                 ]
         else:
             extra_headers = []
 
+        if not x509:
+            self._host_info[key] = host, extra_headers, x509
         return host, extra_headers, x509
 
     ##
@@ -889,21 +1015,69 @@ class Transport:
             host = self._hosts301[host]
         if self._connection and host == self._connection[0]:
             return self._connection[1]
-        # create a HTTP connection object from a host descriptor
         chost, self._extra_headers, x509 = self.get_host_info(host)
-        self._connection = host, http.client.HTTPConnection(chost, timeout=self._timeout)
-        return self._connection[1]
+        connection = None
+        while True:
+            with self._pool_lock:
+                pool = self._pool.get(host)
+                if not pool:
+                    break
+                connection = pool.pop()
+            if _is_alive(connection):
+                break
+            connection.close()
+            connection = None
+        if connection is None:
+            # create a HTTP connection object from a host descriptor
+            connection = self._new_connection(chost, x509)
+        self._connection = host, connection
+        return connection
+
+    def _new_connection(self, chost, x509):
+        return http.client.HTTPConnection(chost, timeout=self._timeout,
+                                          blocksize=self.blocksize)
 
     ##
-    # Clear any cached connection object.
-    # Used in the event of socket errors.
+    # Return the current connection to the pool once its response
+    # has been read completely.
     #
-    def close(self):
+    # @param resp The HTTPResponse read from the connection.
+
+    def _release(self, resp):
+        host, connection = self._connection
+        if connection is None:
+            return
+        self._connection = (None, None)
+        if not resp.will_close:
+            with self._pool_lock:
+                pool = self._pool.setdefault(host, deque())
+                if len(pool) < self.pool_size:
+                    pool.append(connection)
+                    return
+        connection.close()
+
+    ##
+    # Close the connection in use without touching the pool.
+    #
+    def _discard(self):
         host, connection = self._connection
         if connection:
             self._connection = (None, None)
             connection.close()
 
+    ##
+    # Clear any cached connection object.
+    # Used in the event of socket errors.
+    #
+    def close(self):
+        self._discard()
+        # pooled connections to the same server are most likely dead too
+        with self._pool_lock:
+            pools, self._pool = self._pool, {}
+        for pool in pools.values():
+            for connection in pool:
+                connection.close()
+
     ##
     # Send HTTP request.
     #
@@ -915,38 +1089,35 @@ class Transport:
 
     def send_request(self, host, handler, request_body, debug):
         connection = self.make_connection(host)
-        headers = self._extra_headers[:]
-        if self._host_name:
-            headers.insert(0, ("Host", self._host_name))
+        accept_gzip = bool(self.accept_gzip_encoding and gzip)
+        static_headers = self._static_headers(accept_gzip)
+        headers = []
         if debug:
             connection.set_debuglevel(1)
-        if self.accept_gzip_encoding and gzip:
+        if accept_gzip:
             connection.putrequest(self._http_method if request_body else "GET", handler, skip_host=self._host_name, skip_accept_encoding=True)
-            headers.append(("Accept-Encoding", "gzip"))
         else:
             connection.putrequest(self._http_method if request_body else "GET", handler, skip_host=self._host_name)
-        headers.append(("Content-Type", "application/json"))
-        headers.append(("User-Agent", self.user_agent))
-        if self._api_key:
-            headers.append(("X-API-Key", self._api_key))
 
         #optionally encode the request
         encode_chunked = False
         if hasattr(request_body, "read"):
             encode_chunked = True
-        elif request_body.__class__.__name__ == "generator":
+        elif isinstance(request_body, types.GeneratorType):
+            # http.client iterates anything that isn't a buffer or a
+            # file, the generator goes in as it is
             encode_chunked = True
-            class _G(object):
-                def __init__(this, g):
-                    this.__g = g
-                def read(this, n):
-                    try:
-                        return this.__g.__next__()
-                    except StopIteration:
-                        return None
-            request_body = _G(request_body)
+        elif isinstance(request_body, (list, tuple)):
+            # rows of a bulk body: below the threshold the gzip framing
+            # costs more than it saves, send them joined as they are
+            size = sum(map(len, request_body))
+            if gzip and (self.encode_threshold is None or self.encode_threshold < size):
+                headers.append(("Content-Encoding", "gzip"))
+                request_body = gzip_encode(request_body)
+            else:
+                request_body = b"".join(request_body)
         else:
-            if gzip and (request_body.__class__.__name__ in ("list", "tuple") or (self.encode_threshold is not None and self.encode_threshold < len(request_body))):
+            if gzip and (self.encode_threshold is not None and self.encode_threshold < len(request_body)):
                 headers.append(("Content-Encoding", "gzip"))
                 request_body = gzip_encode(request_body)
 
@@ -955,53 +1126,59 @@ class Transport:
         else:
             headers.append(("Content-Length", str(len(request_body))))
 
-        if self._api_headers:
-            od = OrderedDict(headers + self._api_headers)
-            for key, val in od.items():
-                #print(f"header2: {key} = {val}")
-                connection.putheader(key, val)
+        api_headers = self._api_headers
+        if api_headers:
+            # merging by name is only needed when a name repeats
+            names = {key for key, val in api_headers}
+            if (len(names) < len(api_headers) or
+                    not names.isdisjoint(self._header_names) or
+                    any(key in names for key, val in headers)):
+                od = dict([*static_headers, *headers, *api_headers])
+                for key, val in od.items():
+                    #print(f"header2: {key} = {val}")
+                    connection.putheader(key, val)
+            else:
+                for key, val in (*static_headers, *headers, *api_headers):
+                    connection.putheader(key, val)
         else:
-            for key, val in headers:
+            for key, val in (*static_headers, *headers):
                 #print(f"header1: {key} = {val}")
                 connection.putheader(key, val)
 
         connection.endheaders(request_body, encode_chunked=encode_chunked)
         return connection
 
+    ##
+    # Headers that do not depend on the request body.  They only change
+    # with the host or the transport settings, so the tuple is built
+    # again only when one of those does.
+    #
+    # @param accept_gzip Whether to ask for a gzipped response.
+    # @return A tuple of (name, value) pairs.
+
+    def _static_headers(self, accept_gzip):
+        key = (self._extra_headers, self._host_name, self._api_key,
+               self.user_agent, accept_gzip)
+        if key != self._headers_key:
+            headers = list(self._extra_headers)
+            if self._host_name:
+                headers.insert(0, ("Host", self._host_name))
+            if accept_gzip:
+                headers.append(_ACCEPT_GZIP_HEADER)
+            headers.append(("Connection", "keep-alive"))
+            headers.append(("Content-Type", "application/json"))
+            headers.append(("User-Agent", self.user_agent))
+            if self._api_key:
+                headers.append(("X-API-Key", self._api_key))
+            self._headers_key, self._headers = key, tuple(headers)
+            self._header_names = frozenset(key for key, val in headers)
+        return self._headers
+
     ##
     # Parse response.
     #
     # @param file Stream.
     # @return Response tuple and target method.
-    """
-    def parse_response(self, response):
-        # read response data from httpresponse, and parse it
-        # Check for new http response object, otherwise it is a file object.
-        if hasattr(response, 'getheader'):
-            if response.getheader("Content-Encoding", "") == "gzip":
-                stream = GzipDecodedResponse(response)
-            else:
-                stream = response
-        else:
-            stream = response
-
-        p, u = self.getparser()
-
-        while 1:
-            data = stream.read(1024)
-            if not data:
-                break
-            if self.verbose:
-                print("body:", repr(data))
-            p.feed(data)
-
-        if stream is not response:
-            stream.close()
-        p.close()
-
-        return u.close()
-    """
-
     def parse_response(self, response):
         # read response data from httpresponse, and parse it
         fg_text = False
@@ -1009,42 +1186,49 @@ class Transport:
         if hasattr(response, 'getheader'):
             #print dir(response)
             #print(response.getheaders())
-            if response.getheader("Content-Encoding", "") == "gzip":
-                stream = GzipDecodedResponse(response)
-            else:
-                stream = response
             if response.getheader("Content-Type", "").startswith("text"):
                 fg_text = True
+            if response.getheader("Content-Encoding", "") == "gzip":
+                # the whole body in one zlib pass, GzipFile would walk
+                # it in 8 KiB reads
+                body = gzip_decode(response.read())
+            elif fg_text and not hasattr(response, 'msg'):
+                body = None
+            else:
+                body = response.read()
         else:
-            stream = response
+            body = None
         if fg_text:
-            if hasattr(stream, 'msg'):
-                r = stream.read().splitlines()
+            if body is not None:
+                r = body.splitlines()
             else:
-                r = stream.readlines()
+                r = response.readlines()
         else:
-            r = json.loads(stream.read().decode('utf8'), object_hook=_object_hook)
+            r = _loads(body if body is not None else response.read())
         if self.verbose:
             print("body:", r)
-        if stream is not response:
-            stream.close()
 
         if fg_text or 'GET' == self._http_method:
             return r
 
+        if not isinstance(r, dict):
+            return r
         if 'method' in r:
-            params = r.pop("params") if "params" in r else []
-            kwargs = r.pop("kwargs") if "kwargs" in r else {}
+            params = r.get("params", _MISSING)
+            if params is _MISSING:
+                params = []
+            kwargs = r.get("kwargs")
             if kwargs:
                 return [params, kwargs]
             else:
                 return params
-        elif 'result' in r:
-            return r.pop('result')
-        elif 'error' in r:
-            raise Fault(*r.pop('error'))
-        else:
-            return r
+        result = r.get('result', _MISSING)
+        if result is not _MISSING:
+            return result
+        error = r.get('error', _MISSING)
+        if error is not _MISSING:
+            raise Fault(*error)
+        return r
 
 
 ##
@@ -1054,31 +1238,25 @@ class SafeTransport(Transport):
     """Handles an HTTPS transaction to an JSON-RPC server."""
 
     def __init__(self, use_datetime=False, use_builtin_types=False, api_key="", host_name="", *,
-                 context=None):
-        super().__init__(use_datetime=use_datetime, use_builtin_types=use_builtin_types, api_key=api_key, host_name=host_name)
+                 context=None, max_keepalive=None):
+        super().__init__(use_datetime=use_datetime, use_builtin_types=use_builtin_types, api_key=api_key, host_name=host_name,
+                         max_keepalive=max_keepalive)
+        if context is None and hasattr(http.client, "HTTPSConnection"):
+            context = _ssl_context()
         self.context = context
 
     # FIXME: mostly untested
 
-    def make_connection(self, host):
-        if host in self._hosts301:
-            #print('301', host, self._hosts301[host])
-            host = self._hosts301[host]
-        if self._connection and host == self._connection[0]:
-            return self._connection[1]
-
+    def _new_connection(self, chost, x509):
         if not hasattr(http.client, "HTTPSConnection"):
             raise NotImplementedError(
             "your version of http.client doesn't support HTTPS")
         # create a HTTPS connection object from a host descriptor
         # host may be a string, or a (host, x509-dict) tuple
-
-        chost, self._extra_headers, x509 = self.get_host_info(host)
-        kw = x509 or {}
+        kw = dict(x509 or {})
         kw['timeout'] = self._timeout
-        self._connection = host, http.client.HTTPSConnection(chost, 
-            None, context=self.context, **kw)
-        return self._connection[1]
+        return http.client.HTTPSConnection(chost,
+            None, context=self.context, blocksize=self.blocksize, **kw)
 
 ##
 # Standard server proxy.  This class establishes a virtual connection
@@ -1221,6 +1399,90 @@ class ServerProxy:
     def __exit__(self, *args):
         self.__close()
 
+class _LineReader(object):
+    # lines and exact-size reads over an HTTP response, refilled with
+    # read1() in 64 KiB steps instead of a readline() call per line
+    # (per byte peek/read for chunked responses)
+
+    def __init__(self, f, size=65536):
+        self._f = f
+        self._size = size
+        self._buf = bytearray()
+
+    def readline(self):
+        buf = self._buf
+        start = 0
+        while True:
+            i = buf.find(b'\n', start)
+            if i >= 0:
+                line = bytes(buf[:i + 1])
+                del buf[:i + 1]
+                return line
+            start = len(buf)
+            data = self._f.read1(self._size)
+            if not data:
+                line = bytes(buf)
+                buf.clear()
+                return line
+            buf += data
+
+    def read(self, n):
+        buf = self._buf
+        while len(buf) < n:
+            data = self._f.read1(max(n - len(buf), self._size))
+            if not data:
+                break
+            buf += data
+        data = bytes(buf[:n])
+        del buf[:n]
+        return data
+
+    def __iter__(self):
+        readline = self.readline
+        while True:
+            line = readline()
+            if not line:
+                return
+            yield line
+
+def _sse_direct(url):
+    # no proxy from the environment applies to url
+    u = urllib.parse.urlsplit(url)
+    return u.scheme not in urllib.request.getproxies() or urllib.request.proxy_bypass(u.hostname or '')
+
+def _sse_request(conn, url, payload, headers, direct):
+    # -> (connection, response). A direct url is asked on conn, kept
+    # between reconnects. Otherwise, or when the answer is a redirect,
+    # urlopen asks for url again and deals with the proxy and the
+    # redirects; the connection is None then. Anything but a 2xx answer
+    # raises HTTPError.
+    timeout = 5 + random.random()
+    if direct:
+        u = urllib.parse.urlsplit(url)
+        if conn is None:
+            if 'https' == u.scheme:
+                conn = http.client.HTTPSConnection(u.netloc, timeout=timeout, context=_ssl_context())
+            else:
+                conn = http.client.HTTPConnection(u.netloc, timeout=timeout)
+        target = (u.path or '/') + ('?' + u.query if u.query else '')
+        try:
+            conn.request("GET" if payload is None else "POST", target, body=payload, headers=headers)
+            f = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+        if f.status not in (301, 302, 303, 307, 308) or not f.getheader("Location"):
+            if not 200 <= f.status < 300:
+                conn.close()
+                raise urllib.error.HTTPError(url, f.status, f.reason, f.headers, f)
+            return conn, f
+        f.close()
+        conn.close()
+    f = urllib.request.urlopen(urllib.request.Request(url, data=payload, headers=headers), timeout=timeout)
+    return None, f
+
+_SSE_BACKOFF_CAP = 60.0
+
 def sse(url, payload=None, last_event_id=None, api_key=None, host_name=None, fg_ping=False):
     """
     g = sse(url)
@@ -1239,19 +1501,35 @@ def sse(url, payload=None, last_event_id=None, api_key=None, host_name=None, fg_
         headers["Host"] = host_name
     if api_key:
         headers["X-API-Key"] = api_key
+    if payload is not None:
+        # what urlopen sent with a POST body
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
     retry = 2000
+    # reconnect delay: decorrelated jitter between the server's retry and
+    # _SSE_BACKOFF_CAP, back to retry once a stream was opened
+    delay = 0
+    # the connection outlives a stream the server ended cleanly, so a
+    # reconnect doesn't cost a new TCP/TLS handshake; once the url went
+    # through a proxy or redirected, urlopen asks for it every time
+    conn = None
+    direct = _sse_direct(url)
     while True:
         f = None
+        reuse = False
+        ok = False
         if last_event_id:
             headers["Last-Event-ID"] = last_event_id
         try:
             event, data, event_id = "", None, ""
             #f = urllib2.urlopen(urllib2.Request(url, data=payload, headers=headers), timeout=5+random.random())
             #for v in f.fp._sock.fp:
-            f = urllib.request.urlopen(urllib.request.Request(url, data=payload, headers=headers), timeout=5+random.random())
+            conn, f = _sse_request(conn, url, payload, headers, direct)
+            direct = conn is not None
+            ok = True
             #print(11, url)
             #print(22, f.geturl())
-            for v in f:
+            r = _LineReader(f)
+            for v in r:
                 v = v.decode()
                 #print('in:', repr(v))
                 if '' == v:
@@ -1266,31 +1544,34 @@ def sse(url, payload=None, last_event_id=None, api_key=None, host_name=None, fg_
                         yield [event, data, event_id]
                     event, data, event_id = "", None, ""
                 else:
-                    try:
-                        k, v = v.split(':', 1)
-                    except:
+                    k, sep, v = v.partition(':')
+                    if not sep:
                         break
-                    v = v[1:-1] if v and v[0] == ' ' else v[:-1]
-                    if not k and fg_ping:
+                    v = v[1:-1] if v[:1] == ' ' else v[:-1]
+                    # most frequent field first
+                    if "data" == k:
+                        if data:
+                            data.append(v)
+                        else:
+                            data = [v,]
+                    elif not k and fg_ping:
                         event = 'ping'
                     elif "chunk" == k:
                         if data:
-                            data.append(f.read(int(v)))
+                            data.append(r.read(int(v)))
                         else:
-                            data = [f.read(int(v)),]
-                        f.readline()
+                            data = [r.read(int(v)),]
+                        r.readline()
                     elif "event" == k:
                         event = v
-                    elif "data" == k:
-                        if data:
-                            data.append(v)
-                        else:
-                            data = [v,]
                     elif "id" == k:
                         event_id = v
                         last_event_id = v
                     elif "retry" == k:
                         retry = int(v)
+            # the body was read to its end (readline() leaves a fully read
+            # length-delimited response open), the connection can go on
+            reuse = (f.isclosed() or f.length == 0) and not f.will_close
         except (KeyboardInterrupt, SystemExit) as e:
             break
         except Exception as e:
@@ -1300,8 +1581,17 @@ def sse(url, payload=None, last_event_id=None, api_key=None, host_name=None, fg_
             if f:
                 try: f.close()
                 except: pass
-        try: time.sleep(retry / 1000.0 + random.random())
+            if conn and not reuse:
+                conn.close()
+                conn = None
+        base = retry / 1000.0
+        if ok or delay < base:
+            delay = base
+        delay = min(_SSE_BACKOFF_CAP, random.uniform(base, delay * 3))
+        try: time.sleep(delay)
         except: break
+    if conn:
+        conn.close()
 
 # compatibility
 
@@ -0,0 +1,89 @@
+# coding: utf-8
+#
+# JSON backend for the JSON-RPC client and server.
+#
+# orjson (C extension) is used when it is installed, the standard json
+# module handles the rest: everything when orjson is missing, and
+# integers wider than 64 bits on output, which orjson refuses.
+# Unlike json, orjson writes NaN/Infinity as null and reads integers
+# wider than 64 bits as floats; callers that need those values exact
+# ask for json with allow_nan / exact_ints.
+# Both directions work with UTF-8 bytes, so callers don't need to
+# decode a response body before parsing it.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+import json
+
+__all__ = ['orjson', 'dumps', 'loads']
+
+if orjson:
+    # datetimes go through default() to keep their str() format
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+##
+# Serialize a Python object.
+#
+# @param obj The object to serialize.
+# @param default Called for objects neither backend knows, must return
+#     a serializable object or raise TypeError.
+# @param encoder A json.JSONEncoder for the stdlib path, reused between
+#     calls; one is built from default when omitted.
+# @param allow_nan Write NaN/Infinity as json does (not valid JSON)
+#     instead of orjson's null; skips orjson.
+# @return JSON text as UTF-8 bytes.
+
+def dumps(obj, default=None, encoder=None, allow_nan=False):
+    if orjson and not allow_nan:
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # e.g. integers wider than 64 bits, let json decide
+            pass
+    if encoder is None:
+        encoder = json.JSONEncoder(ensure_ascii=False, default=default)
+    return encoder.encode(obj).encode("utf-8")
+
+def _apply_object_hook(obj, object_hook):
+    # orjson has no object_hook, so walk the decoded tree bottom-up
+    # the way json calls it
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if isinstance(v, (dict, list)):
+                obj[k] = _apply_object_hook(v, object_hook)
+        return object_hook(obj)
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            if isinstance(v, (dict, list)):
+                obj[i] = _apply_object_hook(v, object_hook)
+    return obj
+
+##
+# Parse JSON text.
+#
+# @param data JSON text, str or a bytes-like object in UTF-8.
+# @param object_hook Called for every decoded object, as in json.loads.
+# @param marker If given, object_hook only runs when this string occurs
+#     in the text at all.
+# @param exact_ints Keep integers wider than 64 bits exact instead of
+#     orjson's float; skips orjson.
+# @return The decoded Python object.
+
+def loads(data, object_hook=None, marker=None, exact_ints=False):
+    if object_hook is not None and marker is not None:
+        if not isinstance(data, str):
+            marker = marker.encode("utf-8")
+        if marker not in data:
+            object_hook = None
+    if orjson and not exact_ints:
+        try:
+            r = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+        else:
+            return _apply_object_hook(r, object_hook) if object_hook else r
+    if not isinstance(data, str):
+        data = bytes(data).decode('utf8')
+    return json.loads(data, object_hook=object_hook)
@@ -118,6 +118,7 @@ import re
 import pydoc
 import inspect
 import traceback
+import functools
 try:
     import fcntl
 except ImportError:
@@ -153,7 +154,26 @@ def list_public_methods(obj):
 
     return [member for member in dir(obj)
                 if not member.startswith('_') and
-                    callable(getattr(obj, member))]
+                    callable(getattr(obj, member, None))]
+
+def _parse_query(query):
+    """Returns the (params, kwargs) of a GET call's query string: bare
+    names are positional parameters, name=value pairs keyword ones.
+
+    parse_qsl() can't be used, it doesn't tell "a" from "a="; '+' is
+    a space all the same."""
+
+    params = []
+    kwargs = {}
+    for kv in query.split('&'):
+        if not kv:
+            continue
+        k, eq, v = kv.partition('=')
+        if eq:
+            kwargs[urllib.parse.unquote_plus(k).strip()] = urllib.parse.unquote_plus(v).strip()
+        else:
+            params.append(urllib.parse.unquote_plus(k).strip())
+    return params, kwargs
 
 class SimpleJSONRPCDispatcher:
     """Mix-in class that dispatches JSON-RPC requests.
@@ -164,6 +184,10 @@ class SimpleJSONRPCDispatcher:
     can be instanced when used by the MultiPathJSONRPCServer
     """
 
+    # include tracebacks in fault strings; a class attribute, so the
+    # error paths don't need hasattr()
+    _send_traceback_header = False
+
     def __init__(self, allow_none=True, encoding=None,
                  use_builtin_types=False):
         self.funcs = {}
@@ -171,6 +195,10 @@ class SimpleJSONRPCDispatcher:
         self.allow_none = allow_none
         self.encoding = encoding or 'utf-8'
         self.use_builtin_types = use_builtin_types
+        # method name -> callable found on the instance by _dispatch
+        self._resolve_cache = {}
+        # list_public_methods(self.instance), made by system_listMethods
+        self._instance_methods = None
 
     def register_instance(self, instance, allow_dotted_names=False):
         """Registers an instance to respond to JSON-RPC requests.
@@ -207,6 +235,8 @@ class SimpleJSONRPCDispatcher:
 
         self.instance = instance
         self.allow_dotted_names = allow_dotted_names
+        self._resolve_cache.clear()
+        self._instance_methods = None
 
     def register_function(self, function, name=None):
         """Registers a function to respond to JSON-RPC requests.
@@ -218,6 +248,7 @@ class SimpleJSONRPCDispatcher:
         if name is None:
             name = function.__name__
         self.funcs[name] = function
+        self._resolve_cache.clear()
 
     def register_introspection_functions(self):
         """Registers the JSON-RPC introspection methods in the system
@@ -229,6 +260,7 @@ class SimpleJSONRPCDispatcher:
         self.funcs.update({'system.listMethods' : self.system_listMethods,
                       'system.methodSignature' : self.system_methodSignature,
                       'system.methodHelp' : self.system_methodHelp})
+        self._resolve_cache.clear()
 
     def register_multicall_functions(self):
         """Registers the JSON-RPC multicall method in the system
@@ -237,6 +269,7 @@ class SimpleJSONRPCDispatcher:
         see http://www.jsonrpc.com/discuss/msgReader$1208"""
 
         self.funcs.update({'system.multicall' : self.system_multicall})
+        self._resolve_cache.clear()
 
     def _marshaled_dispatch(self, data, dispatch_method = None, path = None):
         """Dispatches an JSON-RPC method from marshalled (JSON) data.
@@ -268,7 +301,7 @@ class SimpleJSONRPCDispatcher:
         except:
             # report exception back to server
             exc_type, exc_value, exc_tb = sys.exc_info()
-            if hasattr(self, '_send_traceback_header') and self._send_traceback_header:
+            if self._send_traceback_header:
                 exc_value = str(exc_value) + '\n' + traceback.format_exc()
                 print(exc_value, flush=True)
             response = dumps(
@@ -302,7 +335,9 @@ class SimpleJSONRPCDispatcher:
             # don't have enough information to provide a list
             # of methods
             elif not hasattr(self.instance, '_dispatch'):
-                methods |= set(list_public_methods(self.instance))
+                if self._instance_methods is None:
+                    self._instance_methods = frozenset(list_public_methods(self.instance))
+                methods |= self._instance_methods
         return sorted(methods)
 
     def system_methodSignature(self, method_name):
@@ -382,7 +417,7 @@ class SimpleJSONRPCDispatcher:
                     )
             except:
                 exc_type, exc_value, exc_tb = sys.exc_info()
-                if hasattr(self, '_send_traceback_header') and self._send_traceback_header:
+                if self._send_traceback_header:
                     exc_value = str(exc_value) + '\n' + traceback.format_exc()
                 results.append(
                     {'faultCode' : 1,
@@ -421,21 +456,50 @@ class SimpleJSONRPCDispatcher:
                 if hasattr(self.instance, '_dispatch'):
                     return self.instance._dispatch(method, params, kwargs)
                 else:
-                    # call instance method directly
-                    try:
-                        func = resolve_dotted_attribute(
-                            self.instance,
-                            method,
-                            self.allow_dotted_names
-                            )
-                    except AttributeError:
-                        pass
+                    # call instance method directly; names resolved once
+                    # are kept until the next register_*() call (misses
+                    # are not, a client could send any number of them)
+                    func = self._resolve_cache.get(method)
+                    if func is None:
+                        try:
+                            func = resolve_dotted_attribute(
+                                self.instance,
+                                method,
+                                self.allow_dotted_names
+                                )
+                        except AttributeError:
+                            pass
+                        else:
+                            self._resolve_cache[method] = func
 
         if func is not None:
             return func(*params, **kwargs)
         else:
             raise Exception('method "%s" is not supported' % method)
 
+# responses the caller marks as repeated byte for byte (the handler's
+# gzip_cache_methods) are compressed once; larger ones aren't kept
+_GZIP_CACHE_MAX_SIZE = 64*1024
+
+@functools.lru_cache(maxsize=64)
+def _gzip_encode_cached(data):
+    return gzip_encode(data)
+
+def _gzip_response(data, cache=False):
+    if cache and len(data) <= _GZIP_CACHE_MAX_SIZE:
+        return _gzip_encode_cached(data)
+    return gzip_encode(data)
+
+def _request_method(data):
+    # method name of a small JSON-RPC call, None for anything else;
+    # introspection calls are a few dozen bytes
+    if len(data) > 256:
+        return None
+    try:
+        return loads(data)[2]
+    except Exception:
+        return None
+
 class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
     """Simple JSON-RPC request handler class.
 
@@ -445,17 +509,55 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
 
     # Class attribute listing the accessible path components;
     # paths not on this list will result in a 404 error.
-    rpc_paths = ('/', '/RPC2')
+    # Tested on every request: subclasses overriding it should use a
+    # set too (an empty tuple still means "all paths").
+    rpc_paths = frozenset(('/', '/RPC2'))
 
     #if not None, encode responses larger than this, if possible
     encode_threshold = 1400 #a common MTU
 
+    # methods answering the same bytes call after call: the gzip encoding
+    # of their responses is cached, every other response is compressed
+    gzip_cache_methods = frozenset(('system.listMethods', 'system.methodHelp',
+                                    'system.methodSignature'))
+
     #Override form StreamRequestHandler: full buffering of output
     #and no Nagle.
     wbufsize = -1
     disable_nagle_algorithm = True
 
-    # a re to match a gzip Accept-Encoding
+    # request bodies left unread by an error response are read away up
+    # to this size, so the connection can be kept; larger ones close it
+    max_discard_size = 64*1024
+
+    def handle(self):
+        """Handle requests on the connection until it is closed or idle
+        for the server's keepalive_timeout seconds.
+
+        An idle kept-alive connection holds a server thread, so servers
+        without a keepalive_timeout (the serial SimpleJSONRPCServer)
+        answer in HTTP/1.0 and close the connection after one request."""
+        keepalive_timeout = getattr(self.server, 'keepalive_timeout', None)
+        if keepalive_timeout:
+            self.protocol_version = "HTTP/1.1"
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            # a timeout here is the normal end of the connection, not an
+            # error worth handle_one_request()'s log line
+            self.connection.settimeout(keepalive_timeout)
+            try:
+                more = self.rfile.peek(1)
+            except OSError:
+                more = b''
+            finally:
+                self.connection.settimeout(self.timeout)
+            if not more:
+                break
+            self.handle_one_request()
+
+    # a re to match a gzip Accept-Encoding; kept for subclasses,
+    # accept_encodings() splits the header by hand
     aepattern = re.compile(r"""
                             \s* ([^\s;]+) \s*            #content-coding
                             (;\s* q \s*=\s* ([0-9\.]+))? #q
@@ -465,11 +567,20 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
         r = {}
         ae = self.headers.get("Accept-Encoding", "")
         for e in ae.split(","):
-            match = self.aepattern.match(e)
-            if match:
-                v = match.group(3)
-                v = float(v) if v else 1.0
-                r[match.group(1)] = v
+            coding, sep, params = e.partition(";")
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            v = 1.0
+            for param in params.split(";") if sep else ():
+                name, sep, q = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        v = float(q)
+                    except ValueError:
+                        pass
+                    break
+            r[coding] = v
         return r
 
     def is_rpc_path_valid(self):
@@ -488,12 +599,10 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(response)
         """
-        pq = self.path.split('?', 1)
-        if pq[0] and pq[0][-1] == '/':
-            pq[0] = pq[0][:-1]
-        path = pq[0].split('/')
-        method =  path.pop(-1)
-        path = '/'.join(path)
+        path, _, query = self.path.partition('?')
+        if path.endswith('/'):
+            path = path[:-1]
+        path, _, method = path.rpartition('/')
         if not path:
             path = '/'
         if self.rpc_paths:
@@ -502,15 +611,7 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
                 return
         #print("1111", path, method)
         try:
-            params = []
-            kwargs = {}
-            if len(pq) > 1:
-                for kv in pq.pop(1).split('&'):
-                    kv = kv.split('=', 1)
-                    if len(kv) > 1:
-                        kwargs[urllib.parse.unquote(kv[0]).strip()] = urllib.parse.unquote(kv[1]).strip()
-                    else:
-                        params.append(urllib.parse.unquote(kv[0]).strip())
+            params, kwargs = _parse_query(query)
             #print("method:", method)
             #print(params)
             #print(kwargs)
@@ -524,8 +625,7 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
             # internal error, report as HTTP server error
             self.send_response(500)
             # Send information about the exception if requested
-            if hasattr(self.server, '_send_traceback_header') and \
-                    self.server._send_traceback_header:
+            if getattr(self.server, '_send_traceback_header', False):
                 self.send_header("X-exception", str(e))
                 trace = traceback.format_exc()
                 trace = str(trace.encode('ASCII', 'backslashreplace'), 'ASCII')
@@ -543,7 +643,7 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
                     q = self.accept_encodings().get("gzip", 0)
                     if q:
                         try:
-                            response = gzip_encode(response)
+                            response = _gzip_response(response, method in self.gzip_cache_methods)
                             self.send_header("Content-Encoding", "gzip")
                         except NotImplementedError:
                             pass
@@ -561,6 +661,9 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
         if not self.is_rpc_path_valid():
             self.report_404()
             return
+        # bytes of the body still unread: None before Content-length is
+        # known, -1 while reading
+        body_left = None
         try:
             # Get arguments by reading body of request.
             # We read this in chunks to avoid straining
@@ -568,15 +671,31 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
             # begin to have problems (bug #792570).
             max_chunk_size = 10*1024*1024
             size_remaining = int(self.headers["content-length"])
-            L = []
-            while size_remaining:
-                chunk_size = min(size_remaining, max_chunk_size)
-                chunk = self.rfile.read(chunk_size)
-                if not chunk:
-                    break
-                L.append(chunk)
-                size_remaining -= len(L[-1])
-            data = b''.join(L)
+            body_left = -1
+            if size_remaining <= max_chunk_size:
+                # one buffer filled in place, no chunks to join; bodies
+                # above the limit are still read chunk by chunk so a
+                # bogus Content-Length doesn't allocate it up front
+                data = bytearray(size_remaining)
+                with memoryview(data) as view:
+                    pos = 0
+                    while pos < size_remaining:
+                        n = self.rfile.readinto(view[pos:])
+                        if not n:
+                            break
+                        pos += n
+                del data[pos:]
+            else:
+                L = []
+                while size_remaining:
+                    chunk_size = min(size_remaining, max_chunk_size)
+                    chunk = self.rfile.read(chunk_size)
+                    if not chunk:
+                        break
+                    L.append(chunk)
+                    size_remaining -= len(L[-1])
+                data = b''.join(L)
+            body_left = 0
 
             data = self.decode_request_content(data)
             if data is None:
@@ -592,11 +711,13 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
                 )
         except Exception as e: # This should only happen if the module is buggy
             # internal error, report as HTTP server error
+            close = not self.discard_request_body(body_left)
             self.send_response(500)
+            if close:
+                self.send_header("Connection", "close")
             #print(111)
             # Send information about the exception if requested
-            if hasattr(self.server, '_send_traceback_header') and \
-                    self.server._send_traceback_header:
+            if getattr(self.server, '_send_traceback_header', False):
                 #print(222)
                 #print(str(e))
                 self.send_header("X-exception", str(e))
@@ -616,7 +737,8 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
                     q = self.accept_encodings().get("gzip", 0)
                     if q:
                         try:
-                            response = gzip_encode(response)
+                            response = _gzip_response(
+                                response, _request_method(data) in self.gzip_cache_methods)
                             self.send_header("Content-Encoding", "gzip")
                         except NotImplementedError:
                             pass
@@ -641,9 +763,38 @@ class SimpleJSONRPCRequestHandler(BaseHTTPRequestHandler):
         self.send_header("Content-length", "0")
         self.end_headers()
 
+    def discard_request_body(self, size=None):
+        """Read away the rest of the request body before an error response.
+
+        size is the number of unread bytes, the Content-length when None,
+        -1 when unknown. Returns False, and marks the connection to be
+        closed, when the body is larger than max_discard_size or can't be
+        read to its end."""
+        if size is None:
+            try:
+                size = int(self.headers.get("content-length") or 0)
+            except ValueError:
+                size = -1
+        if 0 <= size <= self.max_discard_size:
+            try:
+                while size:
+                    chunk = self.rfile.read(size)
+                    if not chunk:
+                        break
+                    size -= len(chunk)
+            except OSError:
+                pass
+            if not size:
+                return True
+        self.close_connection = True
+        return False
+
     def report_404 (self):
             # Report a 404 error
+        close = not self.discard_request_body()
         self.send_response(404)
+        if close:
+            self.send_header("Connection", "close")
         response = b'No such page'
         self.send_header("Content-type", "text/plain")
         self.send_header("Content-length", str(len(response)))
@@ -678,6 +829,11 @@ class SimpleJSONRPCServer(socketserver.TCPServer,
     # SimpleJSONRPCRequestHandler.do_POST
     _send_traceback_header = False
 
+    # seconds a connection is kept open waiting for its next request;
+    # None closes it after every response: this server handles one
+    # connection at a time, an idle client would block all others
+    keepalive_timeout = None
+
     def __init__(self, addr, requestHandler=SimpleJSONRPCRequestHandler,
                  logRequests=True, allow_none=True, encoding=None,
                  bind_and_activate=True, use_builtin_types=False):
@@ -687,6 +843,21 @@ class SimpleJSONRPCServer(socketserver.TCPServer,
         socketserver.TCPServer.__init__(self, addr, requestHandler, bind_and_activate)
 
 
+class ThreadingSimpleJSONRPCServer(socketserver.ThreadingMixIn,
+                                   SimpleJSONRPCServer):
+    """Simple JSON-RPC server that handles each connection in a new thread.
+
+    SimpleJSONRPCServer serves one connection at a time, so a single
+    slow client holds everyone else up. The threads are daemonic so they
+    don't keep the process alive on shutdown, and connections are kept
+    alive between requests.
+    jsonrpcsrv.ThreadPoolMixIn bounds the number of threads instead.
+    """
+
+    daemon_threads = True
+    keepalive_timeout = 5
+
+
 class MultiPathJSONRPCServer(SimpleJSONRPCServer):
     """Multipath JSON-RPC Server
     This specialization of SimpleJSONRPCServer allows the user to create
@@ -832,15 +1003,7 @@ class WSGIJSONRPCRequestHandler(SimpleJSONRPCDispatcher):
                 method = uri[:-1].split('/')[-1]
             else:
                 method = uri.split('/')[-1]
-            params = []
-            kwargs = {}
-            if len(pq) > 1:
-                for kv in pq.pop(1).split('&'):
-                    kv = kv.split('=', 1)
-                    if len(kv) > 1:
-                        kwargs[urllib.parse.unquote(kv[0]).strip()] = urllib.parse.unquote(kv[1]).strip()
-                    else:
-                        params.append(urllib.parse.unquote(kv[0]).strip())
+            params, kwargs = _parse_query(pq[1] if len(pq) > 1 else '')
             length = -1
             #print('<%s>' % method, params, kwargs, flush=True)
             request_text = dumps(params, kwargs, method, methodresponse=None, encoding=None, allow_none=1)
@@ -44,18 +44,52 @@ import ms71jsonrpc.server
 from multiprocessing import Process, Queue, current_process, freeze_support
 
 import socketserver
-
-class SimpleThreadedJSONRPCServer(socketserver.ThreadingMixIn, ms71jsonrpc.server.SimpleJSONRPCServer):
-    daemon_threads = True
+from concurrent.futures import ThreadPoolExecutor
+
+class ThreadPoolMixIn:
+    """Mix-in class to handle each request in a bounded pool of threads
+    instead of a new thread per connection (socketserver.ThreadingMixIn)."""
+
+    max_workers = (os.cpu_count() or 1) * 4
+    # an idle kept-alive connection holds a pool worker while it waits
+    # for its next request, so it gets much less time than with a thread
+    # per connection; the client reconnects when it finds it closed
+    keepalive_timeout = 0.5
+    # created on the first request, so every worker process started by
+    # serve_forever() gets its own threads after the fork
+    _executor = None
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._executor.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+class SimpleThreadedJSONRPCServer(ThreadPoolMixIn, ms71jsonrpc.server.SimpleJSONRPCServer):
     pass
 
-class MultiPathThreadedJSONRPCServer(socketserver.ThreadingMixIn, ms71jsonrpc.server.MultiPathJSONRPCServer):
-    daemon_threads = True
+class MultiPathThreadedJSONRPCServer(ThreadPoolMixIn, ms71jsonrpc.server.MultiPathJSONRPCServer):
     pass
 
-def serve_forever(address, number_of_processes=1, init=None):
+def serve_forever(address, number_of_processes=1, init=None, max_workers=None):
+    """Serve on address with number_of_processes processes of max_workers
+    request threads each."""
     freeze_support()
     server = MultiPathThreadedJSONRPCServer(address, logRequests=True, allow_none=True)
+    if max_workers:
+        server.max_workers = max_workers
     server._send_traceback_header = sys.FG_DEBUG
     server.RequestHandlerClass.rpc_paths = ()
     server.serviceinfo = {"name": None, "api": None, "init": None}
@@ -74,11 +108,12 @@ def serve_forever(address, number_of_processes=1, init=None):
         server.add_dispatcher("/RPC2", d)
 
     port = server.server_address[1]
-    print("Running JSON-RPC {0} on TCP address {1}:{2}{3}{4}".format(
+    print("Running JSON-RPC {0} on TCP address {1}:{2}{3}{4}, {5}x{6} threads".format(
         server.serviceinfo.get("name", "server"),
         address[0], port,
         " (port auto-assigned)" if 0 == address[1] else "",
-        ", gevent on" if sys.FG_GEVENT else ""
+        ", gevent on" if sys.FG_GEVENT else "",
+        number_of_processes, server.max_workers
     ))
     sys.stdout.flush()
     # create child processes to act as workers
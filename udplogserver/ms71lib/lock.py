@@ -3,67 +3,59 @@
 
 __version__ = "2016-07-22 0033"
 
-import sys, os, time, sqlite3, threading
+import sys, os, time, errno, threading
 PY3 = sys.version_info[0] == 3
 
 if PY3:
-    import queue as Queue
     raw_input = input
-else:
-    import Queue
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 def lock_open(lock_path=None):
     pid = os.getpid()
     if not lock_path:
         lock_path = os.path.splitext(os.path.basename(__file__))[0] + '.lock'
 
-    isLocked = False
-    con=cur=None
+    fd = None
     try:
-        con = sqlite3.connect(lock_path, timeout=0.2, isolation_level='EXCLUSIVE')
-        cur = con.cursor()
-        cur.execute('PRAGMA journal_mode = MEMORY;')
-        cur.execute('PRAGMA synchronous = OFF;')
-        cur.execute(u'select * from PID')
-    except sqlite3.OperationalError as e:
-        if e.args[0].lower().find('no such table:')>-1:
-            sql = u"""PRAGMA journal_mode = MEMORY;"""
-            cur.execute(sql)
-            sql = u"""PRAGMA synchronous = OFF;"""
-            cur.execute(sql)
-            sql = u"""CREATE TABLE PID (ID INTEGER NOT NULL, DT TIMESTAMP NOT NULL DEFAULT CURRENCY_TIMESTAMP);"""
-            cur.execute(sql)
-            con.commit()
-        elif e.args[0].lower().find('database is locked')>-1:
-            isLocked = True
-        else:
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        # advisory lock, held until the descriptor is closed
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(pid).encode())
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK, errno.EDEADLK):
             print(e.__class__, e)
-    except Exception as e:
-        print(e.__class__, e)
-    finally:
-        if isLocked:
-            if con:
-                con.close()
-            con=cur=None
-        else:
-            cur.execute(u'insert into pid(id)values(?)', (pid,))
-    if isLocked:
+        if fd is not None:
+            os.close(fd)
         return None
-    else:
-        return [pid, lock_path, con, cur]
+    return [pid, lock_path, fd]
 
 def lock_close(lock):
-    pid, lock_path, con, cur = lock
+    pid, lock_path, fd = lock
     while lock:
         lock.pop()
-    if cur:
-        try: cur.close()
+    # remove the file while it is still ours, closing the descriptor
+    # releases the lock
+    if not msvcrt:
+        try: os.remove(lock_path)
         except: pass
-    if con:
-        try: con.close()
-        except: pass
-    try: os.remove(lock_path)
+    try: os.close(fd)
     except: pass
+    if msvcrt:
+        try: os.remove(lock_path)
+        except: pass
 
 def start(func, *a, **kw):
     def _f(cb):
@@ -131,20 +123,13 @@ class _ThreadResult(object):
     def __init__(self):
         self.__result = None
         self.__error = None
-        self.__isWait = False
-        self.__qWait = Queue.Queue(1)
+        self.__evt = threading.Event()
         self.__isReady = 0
         self.__resolve = None
         self.__reject = None
 
     def wait(self):
-        try:
-            if self.__isReady < 1:
-                self.__isWait = True
-                self.__qWait.get()
-                self.__qWait.task_done()
-        finally:
-            self.__isWait = False
+        self.__evt.wait()
 
     def done(self, resolve, reject=None):
         if resolve:
@@ -173,8 +158,7 @@ class _ThreadResult(object):
                 if self.__resolve:
                     self.__isReady = 2
                     self.__resolve(self.__result)
-            if self.__isWait:
-                self.__qWait.put(1)
+            self.__evt.set()
 
 
 ########################################################################
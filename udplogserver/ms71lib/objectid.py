@@ -4,64 +4,22 @@
 
 __all__ = ["ObjectId"]
 
-import sys
-import binascii, base64
+import base64
 import calendar
 import datetime
-try:
-    import hashlib
-    _md5func = hashlib.md5
-except ImportError:  # for Python < 2.5
-    import md5
-    _md5func = md5.new
+import functools
+import itertools
 import os
 import random
 import socket
 import struct
-import threading
 import time
+import zlib
 
 class InvalidId(Exception):
     """Raised when trying to create an ObjectId from invalid data.
     """
 
-PY3 = sys.version_info[0] > 2
-
-if PY3:
-    import codecs
-
-    from io import BytesIO as StringIO
-
-    def b(s):
-        return codecs.latin_1_encode(s)[0]
-
-    def bytes_from_hex(h):
-        return bytes.fromhex(h)
-
-    binary_type = bytes
-    text_type   = str
-    next_item   = "__next__"
-
-else:
-    try:
-        from cStringIO import StringIO
-    except ImportError:
-        from StringIO import StringIO
-
-    def b(s):
-        # See comments above. In python 2.x b('foo') is just 'foo'.
-        return s
-
-    def bytes_from_hex(h):
-        return h.decode('hex')
-
-    binary_type = str
-    # 2to3 will convert this to "str". That's okay
-    # since we won't ever get here under python3.
-    text_type   = unicode
-    next_item   = "next"
-
-string_types = (binary_type, text_type)
 
 class FixedOffset(datetime.tzinfo):
     """Fixed offset timezone, in minutes east from UTC.
@@ -72,62 +30,105 @@ class FixedOffset(datetime.tzinfo):
     """
     ZERO = datetime.timedelta(0)
 
+    __slots__ = ('_offset', '_name')
+
     def __init__(self, offset, name):
         if isinstance(offset, datetime.timedelta):
-            self.__offset = offset
+            self._offset = offset
         else:
-            self.__offset = datetime.timedelta(minutes=offset)
-        self.__name = name
+            self._offset = datetime.timedelta(minutes=offset)
+        self._name = name
 
     def __getinitargs__(self):
-        return self.__offset, self.__name
+        return self._offset, self._name
 
     def utcoffset(self, dt):
-        return self.__offset
+        return self._offset
 
     def tzname(self, dt):
-        return self.__name
+        return self._name
 
     def dst(self, dt):
         return self.ZERO
 
-utc = FixedOffset(0, "UTC")
+# FixedOffset stays for existing users; the C implemented timezone
+# doesn't dispatch utcoffset() to Python code
+utc = datetime.timezone.utc
+
 
+ZERO  = b"\x00"
 
-EMPTY = b("")
-ZERO  = b("\x00")
+# what str(ObjectId) gives: "hex" (24 characters) or "txt" (16 characters
+# of urlsafe base64, a third less to send and log); both parse back
+OBJECTID_STR_FORMAT = os.environ.get("OBJECTID_STR", "hex")
+
+# compiled once, pack()/unpack() would look the format up on every call
+# time, machine + pid, counter
+_OID_STRUCT = struct.Struct(">I5s3s")
+_TS_STRUCT = struct.Struct(">I")
+# from_datetime() and generation_time: times before 1970 are negative
+_SIGNED_TS_STRUCT = struct.Struct(">i")
+_PID_STRUCT = struct.Struct(">H")
 
 def _machine_bytes():
     """Get the machine portion of an ObjectId.
     """
-    machine_hash = _md5func()
-    if PY3:
-        # gethostname() returns a unicode string in python 3.x
-        # while update() requires a byte string.
-        machine_hash.update(socket.gethostname().encode())
-    else:
-        # Calling encode() here will fail with non-ascii hostnames
-        machine_hash.update(socket.gethostname())
-    return machine_hash.digest()[0:3]
+    # only 3 bytes are kept, a crc32 of the host name does as well as md5
+    hostname = socket.gethostname().encode()
+    return _TS_STRUCT.pack(zlib.crc32(hostname))[0:3]
+
+
+def _binary_oid(oid):
+    # 12 characters are only taken as raw bytes
+    if isinstance(oid, bytes):
+        return oid
+    raise ValueError(oid)
+
+# input length -> decoder, TypeError/ValueError means an invalid id
+_VALIDATORS = {
+    12: _binary_oid,
+    16: base64.urlsafe_b64decode,
+    24: bytes.fromhex,
+}
+
+
+# is_valid() without building an ObjectId or formatting an InvalidId;
+# the same ids tend to come again (log replay), so answers are cached.
+# Callers check the length first: only 12/16/24-character inputs may
+# become cache keys
+@functools.lru_cache(maxsize=4096)
+def _is_valid_string(oid):
+    try:
+        _VALIDATORS[len(oid)](oid)
+    except (TypeError, ValueError):
+        return False
+    return True
 
 
 def _raise_invalid_id(oid):
+    # the input may be as large as a datagram, only its start is quoted
+    shown = repr(oid) if len(oid) <= 64 else repr(oid[:64]) + "..."
     raise InvalidId(
-        "%r is not a valid ObjectId, it must be a 12-byte input"
+        "%s is not a valid ObjectId, it must be a 12-byte input"
         " of type %r or a 16-character base64 string or a 24-character hex string" % (
-            oid, binary_type.__name__))
+            shown, bytes.__name__))
 
 
 class ObjectId(object):
     """A MongoDB ObjectId.
     """
 
-    _inc = random.randint(0, 0xFFFFFF)
-    _inc_lock = threading.Lock()
+    # count.__next__ runs in C, atomic under the GIL: no lock needed
+    _inc_next = itertools.count(random.randint(0, 0xFFFFFF)).__next__
 
     _machine_bytes = _machine_bytes()
 
-    __slots__ = ('__id')
+    # machine + pid part of every generated id, see _reset_machine_pid()
+    _machine_pid = _machine_bytes + _PID_STRUCT.pack(os.getpid() % 0xFFFF)
+
+    # __hex: hex form of the id, filled in on first use
+    # __hash: hash of the id, left unset until the first hash()
+    __slots__ = ('__id', '__hex', '__hash')
 
     _type_marker = 7
 
@@ -143,7 +144,7 @@ class ObjectId(object):
 
         By default, ``ObjectId()`` creates a new unique identifier. The
         optional parameter `oid` can be an :class:`ObjectId`, or any 12
-        :class:`bytes` or, in Python 2, any 12-character :class:`str`.
+        :class:`bytes`.
 
         For example, the 12 bytes b'foo-bar-quux' do not follow the ObjectId
         specification but they are acceptable input::
@@ -151,14 +152,10 @@ class ObjectId(object):
           >>> ObjectId(b'foo-bar-quux')
           ObjectId('666f6f2d6261722d71757578')
 
-        `oid` can also be a :class:`unicode` or :class:`str` of 24 hex digits::
+        `oid` can also be a :class:`str` of 24 hex digits::
 
           >>> ObjectId('0123456789ab0123456789ab')
           ObjectId('0123456789ab0123456789ab')
-          >>>
-          >>> # A u-prefixed unicode literal:
-          >>> ObjectId(u'0123456789ab0123456789ab')
-          ObjectId('0123456789ab0123456789ab')
 
         Raises :class:`~InvalidId` if `oid` is not 12 bytes nor
         24 hex digits, or :class:`TypeError` if `oid` is not an accepted type.
@@ -172,6 +169,7 @@ class ObjectId(object):
 
         .. mongodoc:: objectids
         """
+        self.__hex = None
         if oid is None:
             self.__generate()
         else:
@@ -214,9 +212,77 @@ class ObjectId(object):
         if generation_time.utcoffset() is not None:
             generation_time = generation_time - generation_time.utcoffset()
         ts = calendar.timegm(generation_time.timetuple())
-        oid = struct.pack(">i", int(ts)) + ZERO * 8
+        # signed, as generation_time reads it back; times outside the
+        # int32 range (before 1901, after 2038) raise struct.error
+        oid = _SIGNED_TS_STRUCT.pack(int(ts)) + ZERO * 8
         return cls(oid)
 
+    @classmethod
+    def new(cls):
+        """Create a new unique ObjectId.
+
+        Same as ``ObjectId()``, without going through the argument
+        handling of :meth:`__init__`; meant for code minting ids in a loop.
+        """
+        self = object.__new__(cls)
+        self.__hex = None
+        # __generate() inlined
+        self.__id = _OID_STRUCT.pack(int(time.time()), ObjectId._machine_pid,
+                                     (ObjectId._inc_next() & 0xFFFFFF).to_bytes(3, "big"))
+        return self
+
+    @classmethod
+    def generate_many(cls, n):
+        """Create a list of `n` new ObjectIds at once.
+
+        Equivalent to ``[ObjectId() for i in range(n)]``, but the
+        generation time is read once for the whole batch and the
+        per-instance work is reduced to packing the counter.
+
+        :Parameters:
+          - `n`: number of ObjectIds to create.
+        """
+        now = int(time.time())
+        pack = _OID_STRUCT.pack
+        machine_pid = ObjectId._machine_pid
+        inc_next = ObjectId._inc_next
+        new = cls.__new__
+        oids = []
+        for i in range(n):
+            oid = new(cls)
+            oid.__id = pack(now, machine_pid, (inc_next() & 0xFFFFFF).to_bytes(3, "big"))
+            oid.__hex = None
+            oids.append(oid)
+        return oids
+
+    @classmethod
+    def from_hex_many(cls, hex_ids):
+        """Create ObjectIds from a sequence of 24-character hex strings.
+
+        Equivalent to ``[ObjectId(h) for h in hex_ids]``: all the strings
+        are decoded by one :meth:`bytes.fromhex` call and split into
+        12-byte ids. Raises :class:`~InvalidId` for the first invalid one.
+
+        :Parameters:
+          - `hex_ids`: sequence of :class:`str` of 24 hex digits.
+        """
+        try:
+            data = bytes.fromhex("".join(hex_ids))
+        except (TypeError, ValueError):
+            data = None
+        if data is None or len(data) != 12 * len(hex_ids) or \
+                any(len(h) != 24 for h in hex_ids):
+            # let the constructor find and report the bad one
+            return [cls(h) for h in hex_ids]
+        new = cls.__new__
+        oids = []
+        for i in range(0, len(data), 12):
+            oid = new(cls)
+            oid.__id = data[i:i + 12]
+            oid.__hex = None
+            oids.append(oid)
+        return oids
+
     @classmethod
     def is_valid(cls, oid):
         """Checks if a `oid` string is valid or not.
@@ -228,71 +294,44 @@ class ObjectId(object):
         """
         if not oid:
             return False
-
-        try:
-            ObjectId(oid)
-            return True
-        except (InvalidId, TypeError):
-            return False
+        if isinstance(oid, (bytes, str)):
+            return len(oid) in _VALIDATORS and _is_valid_string(oid)
+        return isinstance(oid, ObjectId)
 
     def __generate(self):
         """Generate a new value for this ObjectId.
         """
-        oid = EMPTY
-
-        # 4 bytes current time
-        oid += struct.pack(">i", int(time.time()))
+        now = int(time.time())
+        inc = ObjectId._inc_next() & 0xFFFFFF
 
-        # 3 bytes machine
-        oid += ObjectId._machine_bytes
-
-        # 2 bytes pid
-        oid += struct.pack(">H", os.getpid() % 0xFFFF)
-
-        # 3 bytes inc
-        ObjectId._inc_lock.acquire()
-        oid += struct.pack(">i", ObjectId._inc)[1:4]
-        ObjectId._inc = (ObjectId._inc + 1) % 0xFFFFFF
-        ObjectId._inc_lock.release()
-
-        self.__id = oid
+        # 4 bytes current time, 3 bytes machine, 2 bytes pid, 3 bytes inc
+        self.__id = _OID_STRUCT.pack(now, ObjectId._machine_pid,
+                                     inc.to_bytes(3, "big"))
 
     def __validate(self, oid):
         """Validate and use the given id for this ObjectId.
 
         Raises TypeError if id is not an instance of
-        (:class:`basestring` (:class:`str` or :class:`bytes`
-        in python 3), ObjectId) and InvalidId if it is not a
-        valid ObjectId.
+        (:class:`str`, :class:`bytes`, ObjectId) and InvalidId
+        if it is not a valid ObjectId.
 
         :Parameters:
           - `oid`: a valid ObjectId
         """
-        if isinstance(oid, ObjectId):
-            self.__id = oid.__id
-        elif isinstance(oid, string_types):
-            len_oid = len(oid)
-            if len_oid == 12:
-                if isinstance(oid, binary_type):
-                    self.__id = oid
-                else:
-                    _raise_invalid_id(oid)
-            elif len_oid == 16:
-                try:
-                    self.__id = base64.urlsafe_b64decode(oid)
-                except (TypeError, ValueError):
-                    _raise_invalid_id(oid)
-            elif len_oid == 24:
-                try:
-                    self.__id = bytes_from_hex(oid)
-                except (TypeError, ValueError):
-                    _raise_invalid_id(oid)
-            else:
+        # strings first: they are what gets parsed most
+        if isinstance(oid, (bytes, str)):
+            decode = _VALIDATORS.get(len(oid))
+            if decode is None:
                 _raise_invalid_id(oid)
+            try:
+                self.__id = decode(oid)
+            except (TypeError, ValueError):
+                _raise_invalid_id(oid)
+        elif isinstance(oid, ObjectId):
+            self.__id = oid.__id
         else:
-            raise TypeError("id must be an instance of (%s, %s, ObjectId), "
-                            "not %s" % (binary_type.__name__,
-                                        text_type.__name__, type(oid)))
+            raise TypeError("id must be an instance of (bytes, str, ObjectId), "
+                            "not %s" % (type(oid),))
 
     @property
     def binary(self):
@@ -304,17 +343,22 @@ class ObjectId(object):
     def txt(self):
         """16-byte text representation of this ObjectId.
         """
-        if PY3:
-            return base64.urlsafe_b64encode(self.__id).decode()
-        return base64.urlsafe_b64encode(self.__id)
+        return base64.urlsafe_b64encode(self.__id).decode()
 
     @property
     def hex(self):
         """24-byte text representation of this ObjectId.
         """
-        if PY3:
-            return binascii.hexlify(self.__id).decode()
-        return binascii.hexlify(self.__id)
+        h = self.__hex
+        if h is None:
+            h = self.__hex = self.__id.hex()
+        return h
+
+    # str() form, picked once by OBJECTID_STR_FORMAT
+    if OBJECTID_STR_FORMAT == "txt":
+        __str__ = txt.fget
+    else:
+        __str__ = hex.fget
 
     @property
     def generation_time(self):
@@ -330,7 +374,7 @@ class ObjectId(object):
 
         .. versionadded:: 1.2
         """
-        t = struct.unpack(">i", self.__id[0:4])[0]
+        t = _SIGNED_TS_STRUCT.unpack_from(self.__id)[0]
         return datetime.datetime.fromtimestamp(t, utc)
 
     def __getstate__(self):
@@ -348,49 +392,48 @@ class ObjectId(object):
             oid = value["_ObjectId__id"]
         else:
             oid = value
+        self.__hex = None
         # ObjectIds pickled in python 2.x used `str` for __id.
         # In python 3.x this has to be converted to `bytes`
         # by encoding latin-1.
-        if PY3 and isinstance(oid, text_type):
+        if isinstance(oid, str):
             self.__id = oid.encode('latin-1')
         else:
             self.__id = oid
 
-    def __str__(self):
-        if PY3:
-            return binascii.hexlify(self.__id).decode()
-        return binascii.hexlify(self.__id)
-
     def __repr__(self):
         return "ObjectId('%s')" % (str(self),)
 
+    # the class identity test answers the usual case without isinstance();
+    # subclasses still compare through it
+
     def __eq__(self, other):
-        if isinstance(other, ObjectId):
+        if other.__class__ is ObjectId or isinstance(other, ObjectId):
             return self.__id == other.__id
         return NotImplemented
 
     def __ne__(self, other):
-        if isinstance(other, ObjectId):
+        if other.__class__ is ObjectId or isinstance(other, ObjectId):
             return self.__id != other.__id
         return NotImplemented
 
     def __lt__(self, other):
-        if isinstance(other, ObjectId):
+        if other.__class__ is ObjectId or isinstance(other, ObjectId):
             return self.__id < other.__id
         return NotImplemented
 
     def __le__(self, other):
-        if isinstance(other, ObjectId):
+        if other.__class__ is ObjectId or isinstance(other, ObjectId):
             return self.__id <= other.__id
         return NotImplemented
 
     def __gt__(self, other):
-        if isinstance(other, ObjectId):
+        if other.__class__ is ObjectId or isinstance(other, ObjectId):
             return self.__id > other.__id
         return NotImplemented
 
     def __ge__(self, other):
-        if isinstance(other, ObjectId):
+        if other.__class__ is ObjectId or isinstance(other, ObjectId):
             return self.__id >= other.__id
         return NotImplemented
 
@@ -399,4 +442,17 @@ class ObjectId(object):
 
         .. versionadded:: 1.1
         """
-        return hash(self.__id)
+        try:
+            return self.__hash
+        except AttributeError:
+            h = self.__hash = hash(self.__id)
+            return h
+
+
+def _reset_machine_pid():
+    # the pid part is computed once; a forked worker needs its own
+    ObjectId._machine_pid = (ObjectId._machine_bytes +
+                             _PID_STRUCT.pack(os.getpid() % 0xFFFF))
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_machine_pid)
@@ -103,7 +103,8 @@ __version__ = "2.2"
 # Based on code written by Fredrik Lundh.
 
 import jsonrpclib
-from jsonrpclib import Fault
+# bound once: no jsonrpclib attribute lookup per request
+from jsonrpclib import Fault, dumps, loads, gzip_encode, gzip_decode
 import SocketServer
 import BaseHTTPServer
 import sys
@@ -116,6 +117,10 @@ except ImportError:
     fcntl = None
 import urllib
 import base64, uuid, threading
+import collections
+import Queue
+import select
+from types import FunctionType
 
 def resolve_dotted_attribute(obj, attr, allow_dotted_names=True):
     """resolve_dotted_attribute(a, 'b.c.d') => a.b.c.d
@@ -149,11 +154,11 @@ def list_public_methods(obj):
     if hasattr(obj, '_prefix') and obj._prefix:
         return [obj._prefix + member for member in dir(obj)
                     if not member.startswith('_') and
-                        hasattr(getattr(obj, member), '__call__')]
+                        callable(getattr(obj, member, None))]
     else:
         return [member for member in dir(obj)
                     if not member.startswith('_') and
-                        hasattr(getattr(obj, member), '__call__')]
+                        callable(getattr(obj, member, None))]
 
 def remove_duplicates(lst):
     """remove_duplicates([2,2,2,1,3,3]) => [3,1,2]
@@ -162,11 +167,26 @@ def remove_duplicates(lst):
     item must be hashable and the order of the items in the
     resulting list is not defined.
     """
-    u = {}
-    for x in lst:
-        u[x] = 1
-
-    return u.keys()
+    return list(set(lst))
+
+def _parse_query(query):
+    """Returns the (params, kwargs) of a GET call's query string: bare
+    names are positional parameters, name=value pairs keyword ones.
+
+    parse_qsl() can't be used, it doesn't tell "a" from "a="; '+' is
+    a space all the same."""
+
+    params = []
+    kwargs = {}
+    for kv in query.split('&'):
+        if not kv:
+            continue
+        k, eq, v = kv.partition('=')
+        if eq:
+            kwargs[urllib.unquote_plus(k).strip()] = urllib.unquote_plus(v).strip()
+        else:
+            params.append(urllib.unquote_plus(k).strip())
+    return params, kwargs
 
 class SimpleJSONRPCDispatcher:
     """Mix-in class that dispatches JSON-RPC requests.
@@ -177,12 +197,20 @@ class SimpleJSONRPCDispatcher:
     can be instanced when used by the MultiPathJSONRPCServer.
     """
 
+    # include tracebacks in fault strings; a class attribute, so the
+    # error paths don't need hasattr()
+    _send_traceback_header = False
+
     def __init__(self, allow_none=True, encoding=None):
         self.funcs = {}
         self.instance = None
         self.allow_none = allow_none
         self.encoding = encoding
         self._path = "/"
+        # method name -> callable found on the instance by _dispatch
+        self._resolve_cache = {}
+        # list_public_methods(self.instance), made by system_listMethods
+        self._instance_methods = None
 
     def register_instance(self, instance, allow_dotted_names=False, prefix=None):
         """Registers an instance to respond to JSON-RPC requests.
@@ -219,6 +247,8 @@ class SimpleJSONRPCDispatcher:
 
         self.instance = instance
         self.allow_dotted_names = allow_dotted_names
+        self._resolve_cache.clear()
+        self._instance_methods = None
 
         if self.instance:
             if prefix:
@@ -236,6 +266,7 @@ class SimpleJSONRPCDispatcher:
         if name is None:
             name = function.__name__
         self.funcs[name] = function
+        self._resolve_cache.clear()
 
     def register_introspection_functions(self):
         """Registers the JSON-RPC introspection methods in the system
@@ -247,6 +278,7 @@ class SimpleJSONRPCDispatcher:
         self.funcs.update({'system.listMethods' : self.system_listMethods,
                       'system.methodSignature' : self.system_methodSignature,
                       'system.methodHelp' : self.system_methodHelp})
+        self._resolve_cache.clear()
 
     def register_multicall_functions(self):
         """Registers the JSON-RPC multicall method in the system
@@ -255,8 +287,7 @@ class SimpleJSONRPCDispatcher:
         see http://www.jsonrpc.com/discuss/msgReader$1208"""
 
         self.funcs.update({'system.multicall' : self.system_multicall})
-
-    _type_function = type(lambda: None)
+        self._resolve_cache.clear()
 
     def _marshaled_dispatch(self, data, dispatch_method = None, path = None):
         """Dispatches an JSON-RPC method from marshalled (JSON) data.
@@ -271,7 +302,7 @@ class SimpleJSONRPCDispatcher:
         """
 
         try:
-            params, kwargs, method = jsonrpclib.loads(data)
+            params, kwargs, method = loads(data)
             #print "method:", method
 
             # generate response
@@ -281,24 +312,24 @@ class SimpleJSONRPCDispatcher:
                 response = self._dispatch(method, params, kwargs)
             #print 333, response
             #sys.stdout.flush()
-            if isinstance(response, self._type_function):
+            if type(response) is FunctionType:
                 return response
             # wrap response in a singleton tuple
             response = (response,)
-            response = jsonrpclib.dumps(response, None, methodresponse=1,
+            response = dumps(response, None, methodresponse=1,
                                        allow_none=self.allow_none, encoding=self.encoding)
         except Fault, fault:
-            response = jsonrpclib.dumps(fault, None, allow_none=self.allow_none,
+            response = dumps(fault, None, allow_none=self.allow_none,
                                        encoding=self.encoding)
         except:
             # report exception back to server
             exc_type, exc_value, exc_tb = sys.exc_info()
-            if hasattr(self, '_send_traceback_header') and self._send_traceback_header:
+            if self._send_traceback_header:
                 exc_value = str(exc_value) + '\n' + traceback.format_exc()
                 print exc_value
                 sys.stdout.flush()
-            response = jsonrpclib.dumps(
-                jsonrpclib.Fault(1, "%s:%s" % (exc_type, exc_value)), None,
+            response = dumps(
+                Fault(1, "%s:%s" % (exc_type, exc_value)), None,
                 encoding=self.encoding, allow_none=self.allow_none,
                 )
         return response
@@ -308,23 +339,20 @@ class SimpleJSONRPCDispatcher:
 
         Returns a list of the methods supported by the server."""
 
-        methods = self.funcs.keys()
+        methods = set(self.funcs)
         if self.instance is not None:
             # Instance can implement _listMethod to return a list of
             # methods
             if hasattr(self.instance, '_listMethods'):
-                methods = remove_duplicates(
-                        methods + self.instance._listMethods()
-                    )
+                methods.update(self.instance._listMethods())
             # if the instance has a _dispatch method then we
             # don't have enough information to provide a list
             # of methods
             elif not hasattr(self.instance, '_dispatch'):
-                methods = remove_duplicates(
-                        methods + list_public_methods(self.instance)
-                    )
-        methods.sort()
-        return methods
+                if self._instance_methods is None:
+                    self._instance_methods = frozenset(list_public_methods(self.instance))
+                methods.update(self._instance_methods)
+        return sorted(methods)
 
     def system_methodSignature(self, method_name):
         """system.methodSignature('add') => [double, int, int]
@@ -426,9 +454,7 @@ class SimpleJSONRPCDispatcher:
                             results.append([id_async,])
                             f = system_emit()
                         #self._system_emit(id_async, method_name, params, kwargs, f)
-                        t = threading.Thread(target=self._system_emit, args=[id_async, method_name, params, kwargs, f])
-                        t.daemon = True
-                        t.start()
+                        self._submit_async(id_async, method_name, params, kwargs, f)
                 else:
                     results.append([self._dispatch(method_name, params, kwargs)])
             except Fault, fault:
@@ -437,13 +463,41 @@ class SimpleJSONRPCDispatcher:
                 )
             except:
                 exc_type, exc_value, exc_tb = sys.exc_info()
-                if hasattr(self, '_send_traceback_header') and self._send_traceback_header:
+                if self._send_traceback_header:
                     exc_value = str(exc_value) + '\n' + traceback.format_exc()
                 results.append(
                     {'error': [1, "%s:%s" % (exc_type, exc_value)]}
                 )
         return results
 
+    # number of threads running the async: calls of system.multicall
+    async_workers = 16
+    _async_pool = None # (pid, queue), started on first use
+    _async_pool_lock = threading.Lock()
+
+    def _submit_async(self, *args):
+        pool = self._async_pool
+        # threads don't survive fork(): a worker process starts its own
+        if pool is None or pool[0] != os.getpid():
+            with self._async_pool_lock:
+                pool = self._async_pool
+                if pool is None or pool[0] != os.getpid():
+                    q = Queue.Queue()
+                    for i in range(self.async_workers):
+                        t = threading.Thread(target=self._async_worker, args=(q,))
+                        t.daemon = True
+                        t.start()
+                    pool = self._async_pool = (os.getpid(), q)
+        pool[1].put(args)
+
+    def _async_worker(self, q):
+        while True:
+            args = q.get()
+            try:
+                self._system_emit(*args)
+            except:
+                traceback.print_exc()
+
     def _system_emit(self, id_async, method_name, params, kwargs, emit=None):
         #print 111; sys.stdout.flush()
         try:
@@ -452,7 +506,7 @@ class SimpleJSONRPCDispatcher:
             _res = {'error': [fault.faultCode, fault.faultString]}
         except:
             exc_type, exc_value, exc_tb = sys.exc_info()
-            if hasattr(self, '_send_traceback_header') and self._send_traceback_header:
+            if self._send_traceback_header:
                 exc_value = str(exc_value) + '\n' + traceback.format_exc()
             _res = {'error': [1, "%s:%s" % (exc_type, exc_value)]}
         #print 222; sys.stdout.flush()
@@ -491,15 +545,21 @@ class SimpleJSONRPCDispatcher:
                 if hasattr(self.instance, '_dispatch'):
                     return self.instance._dispatch(method, params, kwargs)
                 else:
-                    # call instance method directly
-                    try:
-                        func = resolve_dotted_attribute(
-                            self.instance,
-                            method,
-                            self.allow_dotted_names
-                            )
-                    except AttributeError:
-                        pass
+                    # call instance method directly; names resolved once
+                    # are kept until the next register_*() call (misses
+                    # are not, a client could send any number of them)
+                    func = self._resolve_cache.get(method)
+                    if func is None:
+                        try:
+                            func = resolve_dotted_attribute(
+                                self.instance,
+                                method,
+                                self.allow_dotted_names
+                                )
+                        except AttributeError:
+                            pass
+                        else:
+                            self._resolve_cache[method] = func
 
         if func is None:
             raise Exception('method "%s" is not supported' % method)
@@ -507,6 +567,38 @@ class SimpleJSONRPCDispatcher:
             result = func(*params, **kwargs)
             return result
 
+# responses the caller marks as repeated byte for byte (the handler's
+# gzip_cache_methods) are compressed once; larger ones aren't kept
+_GZIP_CACHE_MAX_SIZE = 64*1024
+_GZIP_CACHE_ENTRIES = 64
+_gzip_cache = collections.OrderedDict()
+_gzip_cache_lock = threading.Lock()
+
+def _gzip_response(data, cache=False):
+    if not cache or len(data) > _GZIP_CACHE_MAX_SIZE:
+        return gzip_encode(data)
+    with _gzip_cache_lock:
+        r = _gzip_cache.pop(data, None)
+        if r is not None:
+            _gzip_cache[data] = r
+            return r
+    r = gzip_encode(data)
+    with _gzip_cache_lock:
+        _gzip_cache[data] = r
+        if len(_gzip_cache) > _GZIP_CACHE_ENTRIES:
+            _gzip_cache.popitem(last=False)
+    return r
+
+def _request_method(data):
+    # method name of a small JSON-RPC call, None for anything else;
+    # introspection calls are a few dozen bytes
+    if len(data) > 256:
+        return None
+    try:
+        return loads(data)[2]
+    except Exception:
+        return None
+
 class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     """Simple JSON-RPC request handler class.
 
@@ -516,17 +608,51 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     # Class attribute listing the accessible path components;
     # paths not on this list will result in a 404 error.
-    rpc_paths = ('/', '/RPC2')
+    # Tested on every request: subclasses overriding it should use a
+    # set too (an empty tuple still means "all paths").
+    rpc_paths = frozenset(('/', '/RPC2'))
 
     #if not None, encode responses larger than this, if possible
     encode_threshold = 1400 #a common MTU
 
+    # methods answering the same bytes call after call: the gzip encoding
+    # of their responses is cached, every other response is compressed
+    gzip_cache_methods = frozenset(('system.listMethods', 'system.methodHelp',
+                                    'system.methodSignature'))
+
     #Override form StreamRequestHandler: full buffering of output
     #and no Nagle.
     wbufsize = -1
     disable_nagle_algorithm = True
 
-    # a re to match a gzip Accept-Encoding
+    # request bodies left unread by an error response are read away up
+    # to this size, so the connection can be kept; larger ones close it
+    max_discard_size = 64*1024
+
+    def handle(self):
+        """Handle requests on the connection until it is closed or idle
+        for the server's keepalive_timeout seconds.
+
+        An idle kept-alive connection holds a server thread, so servers
+        without a keepalive_timeout (the serial SimpleJSONRPCServer)
+        answer in HTTP/1.0 and close the connection after one request."""
+        keepalive_timeout = getattr(self.server, 'keepalive_timeout', None)
+        if keepalive_timeout:
+            self.protocol_version = "HTTP/1.1"
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection:
+            # wait for the next request unless it is already buffered
+            rbuf = getattr(self.rfile, '_rbuf', None)
+            if rbuf is None or not rbuf.tell():
+                r, w, x = select.select([self.connection], [], [],
+                                        keepalive_timeout)
+                if not r:
+                    break
+            self.handle_one_request()
+
+    # a re to match a gzip Accept-Encoding; kept for subclasses,
+    # accept_encodings() splits the header by hand
     aepattern = re.compile(r"""
                             \s* ([^\s;]+) \s*            #content-coding
                             (;\s* q \s*=\s* ([0-9\.]+))? #q
@@ -536,11 +662,20 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         r = {}
         ae = self.headers.get("Accept-Encoding", "")
         for e in ae.split(","):
-            match = self.aepattern.match(e)
-            if match:
-                v = match.group(3)
-                v = float(v) if v else 1.0
-                r[match.group(1)] = v
+            coding, sep, params = e.partition(";")
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            v = 1.0
+            for param in params.split(";") if sep else ():
+                name, sep, q = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        v = float(q)
+                    except ValueError:
+                        pass
+                    break
+            r[coding] = v
         return r
 
     def is_rpc_path_valid(self):
@@ -559,29 +694,19 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(response)
         """
-        pq = self.path.split('?', 1)
-        if pq[0] and pq[0][-1] == '/':
-            pq[0] = pq[0][:-1]
-        path = pq[0].split('/')
-        method =  path.pop(-1)
-        path = '/'.join(path)
+        path, _, query = self.path.partition('?')
+        if path.endswith('/'):
+            path = path[:-1]
+        path, _, method = path.rpartition('/')
         if self.rpc_paths:
             if not (path in self.rpc_paths):
                 self.report_404()
                 return
         #print "1111", path, method
         try:
-            params = []
-            kwargs = {}
-            if len(pq) > 1:
-                for kv in pq.pop(1).split('&'):
-                    kv = kv.split('=', 1)
-                    if len(kv) > 1:
-                        kwargs[urllib.unquote(kv[0]).strip()] = urllib.unquote(kv[1]).strip()
-                    else:
-                        params.append(urllib.unquote(kv[0]).strip())
+            params, kwargs = _parse_query(query)
 
-            data = jsonrpclib.dumps(params, kwargs, method, methodresponse=None, encoding=None, allow_none=1)
+            data = dumps(params, kwargs, method, methodresponse=None, encoding=None, allow_none=1)
             #print self.server
             #print data
             response = self.server._marshaled_dispatch(
@@ -592,8 +717,7 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self.send_response(500)
 
             # Send information about the exception if requested
-            if hasattr(self.server, '_send_traceback_header') and \
-                    self.server._send_traceback_header:
+            if getattr(self.server, '_send_traceback_header', False):
                 self.send_header("X-exception", str(e))
                 self.send_header("X-traceback", traceback.format_exc())
 
@@ -610,7 +734,7 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                     q = self.accept_encodings().get("gzip", 0)
                     if q:
                         try:
-                            response = jsonrpclib.gzip_encode(response)
+                            response = _gzip_response(response, method in self.gzip_cache_methods)
                             self.send_header("Content-Encoding", "gzip")
                         except NotImplementedError:
                             pass
@@ -630,6 +754,9 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self.report_404()
             return
 
+        # bytes of the body still unread: None before Content-length is
+        # known, -1 while reading
+        body_left = None
         try:
             # Get arguments by reading body of request.
             # We read this in chunks to avoid straining
@@ -637,6 +764,7 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             # begin to have problems (bug #792570).
             max_chunk_size = 10*1024*1024
             size_remaining = int(self.headers["content-length"])
+            body_left = -1
             L = []
             while size_remaining:
                 chunk_size = min(size_remaining, max_chunk_size)
@@ -646,6 +774,7 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 L.append(chunk)
                 size_remaining -= len(L[-1])
             data = ''.join(L)
+            body_left = 0
 
             data = self.decode_request_content(data)
             if data is None:
@@ -661,11 +790,13 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 )
         except Exception, e: # This should only happen if the module is buggy
             # internal error, report as HTTP server error
+            close = not self.discard_request_body(body_left)
             self.send_response(500)
+            if close:
+                self.send_header("Connection", "close")
 
             # Send information about the exception if requested
-            if hasattr(self.server, '_send_traceback_header') and \
-                    self.server._send_traceback_header:
+            if getattr(self.server, '_send_traceback_header', False):
                 self.send_header("X-exception", str(e))
                 self.send_header("X-traceback", traceback.format_exc())
 
@@ -680,7 +811,8 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                     q = self.accept_encodings().get("gzip", 0)
                     if q:
                         try:
-                            response = jsonrpclib.gzip_encode(response)
+                            response = _gzip_response(
+                                response, _request_method(data) in self.gzip_cache_methods)
                             self.send_header("Content-Encoding", "gzip")
                         except NotImplementedError:
                             pass
@@ -695,7 +827,7 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             return data
         if encoding == "gzip":
             try:
-                return jsonrpclib.gzip_decode(data)
+                return gzip_decode(data)
             except NotImplementedError:
                 self.send_response(501, "encoding %r not supported" % encoding)
             except ValueError:
@@ -705,9 +837,38 @@ class SimpleJSONRPCRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.send_header("Content-length", "0")
         self.end_headers()
 
+    def discard_request_body(self, size=None):
+        """Read away the rest of the request body before an error response.
+
+        size is the number of unread bytes, the Content-length when None,
+        -1 when unknown. Returns False, and marks the connection to be
+        closed, when the body is larger than max_discard_size or can't be
+        read to its end."""
+        if size is None:
+            try:
+                size = int(self.headers.get("content-length") or 0)
+            except ValueError:
+                size = -1
+        if 0 <= size <= self.max_discard_size:
+            try:
+                while size:
+                    chunk = self.rfile.read(size)
+                    if not chunk:
+                        break
+                    size -= len(chunk)
+            except IOError:
+                pass
+            if not size:
+                return True
+        self.close_connection = 1
+        return False
+
     def report_404 (self):
             # Report a 404 error
+        close = not self.discard_request_body()
         self.send_response(404)
+        if close:
+            self.send_header("Connection", "close")
         response = 'No such page'
         self.send_header("Content-type", "text/plain")
         self.send_header("Content-length", str(len(response)))
@@ -742,6 +903,11 @@ class SimpleJSONRPCServer(SocketServer.TCPServer,
     # SimpleJSONRPCRequestHandler.do_POST
     _send_traceback_header = False
 
+    # seconds a connection is kept open waiting for its next request;
+    # None closes it after every response: this server handles one
+    # connection at a time, an idle client would block all others
+    keepalive_timeout = None
+
     def __init__(self, addr, requestHandler=SimpleJSONRPCRequestHandler,
                  logRequests=True, allow_none=True, encoding=None, bind_and_activate=True):
         self.logRequests = logRequests
@@ -757,6 +923,19 @@ class SimpleJSONRPCServer(SocketServer.TCPServer,
             flags |= fcntl.FD_CLOEXEC
             fcntl.fcntl(self.fileno(), fcntl.F_SETFD, flags)
 
+class ThreadingSimpleJSONRPCServer(SocketServer.ThreadingMixIn,
+                                   SimpleJSONRPCServer):
+    """Simple JSON-RPC server that handles each connection in a new thread.
+
+    SimpleJSONRPCServer serves one connection at a time, so a single
+    slow client holds everyone else up. The threads are daemonic so they
+    don't keep the process alive on shutdown, and connections are kept
+    alive between requests.
+    """
+
+    daemon_threads = True
+    keepalive_timeout = 5
+
 class MultiPathJSONRPCServer(SimpleJSONRPCServer):
     """Multipath JSON-RPC Server
     This specialization of SimpleJSONRPCServer allows the user to create
@@ -791,8 +970,8 @@ class MultiPathJSONRPCServer(SimpleJSONRPCServer):
             # (each dispatcher should have handled their own
             # exceptions)
             exc_type, exc_value = sys.exc_info()[:2]
-            response = jsonrpclib.dumps(
-                jsonrpclib.Fault(1, "%s:%s" % (exc_type, exc_value)), None,
+            response = dumps(
+                Fault(1, "%s:%s" % (exc_type, exc_value)), None,
                 encoding=self.encoding, allow_none=self.allow_none)
         return response
 
@@ -805,7 +984,7 @@ class CGIJSONRPCRequestHandler(SimpleJSONRPCDispatcher):
     def handle_jsonrpc(self, request_text):
         """Handle a single JSON-RPC request"""
 
-        response = jsonrpclib.gzip_encode(self._marshaled_dispatch(request_text))
+        response = gzip_encode(self._marshaled_dispatch(request_text))
 
         print 'Content-Type: application/json'
         print 'Content-Encoding: gzip'
@@ -886,21 +1065,13 @@ class WSGIJSONRPCRequestHandler(SimpleJSONRPCDispatcher):
             if pq[0] and pq[0][-1] == '/':
                 pq[0] = pq[0][:-1]
             method =  pq[0].split('/')[-1]
-            params = []
-            kwargs = {}
-            if len(pq) > 1:
-                for kv in pq.pop(1).split('&'):
-                    kv = kv.split('=', 1)
-                    if len(kv) > 1:
-                        kwargs[urllib.unquote(kv[0]).strip()] = urllib.unquote(kv[1]).strip()
-                    else:
-                        params.append(urllib.unquote(kv[0]).strip())
+            params, kwargs = _parse_query(pq[1] if len(pq) > 1 else '')
             length = -1
-            request_text = jsonrpclib.dumps(params, kwargs, method, methodresponse=None, encoding=None, allow_none=1)
+            request_text = dumps(params, kwargs, method, methodresponse=None, encoding=None, allow_none=1)
 
             """Handle a single JSON-RPC request"""
 
-            response = jsonrpclib.gzip_encode(self._marshaled_dispatch(request_text))
+            response = gzip_encode(self._marshaled_dispatch(request_text))
             start_response("200 OK", [
                 ("Content-Type", "application/json; charset=UTF-8"),
                 ("Cache-Control", "no-cache"),
@@ -930,11 +1101,11 @@ class WSGIJSONRPCRequestHandler(SimpleJSONRPCDispatcher):
             if request_text is None:
                 request_text = environ["wsgi.input"].read(length)
                 if "gzip" == environ.get("HTTP_CONTENT_ENCODING", environ.get("CONTENT_ENCODING")):
-                    request_text = jsonrpclib.gzip_decode(request_text)
+                    request_text = gzip_decode(request_text)
 
             """Handle a single JSON-RPC request"""
 
-            response = jsonrpclib.gzip_encode(self._marshaled_dispatch(request_text))
+            response = gzip_encode(self._marshaled_dispatch(request_text))
             start_response("200 OK", [
                 ("Content-Type", "application/json"),
                 ("Content-Encoding", "gzip"),